@@ -0,0 +1 @@
+"""benchmarks of compare_brain_maps estimators on synthetic atlases, run with airspeed velocity (asv)"""
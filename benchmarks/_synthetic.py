@@ -0,0 +1,114 @@
+"""synthetic geodesic icospheres standing in for surface atlases, without network access"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from nilearn.surface import InMemoryMesh
+from sklearn.utils import Bunch
+
+from compare_brain_maps.utils import surface
+
+# geodesic subdivision frequency f of an icosahedron with 10 * f**2 + 2 vertices, matching each atlas density
+FREQUENCIES = {
+    ("fsaverage", "3k"): 16,
+    ("fsaverage", "10k"): 32,
+    ("fsaverage", "41k"): 64,
+    ("fsaverage", "164k"): 128,
+    ("fsLR", "4k"): 20,
+    ("fsLR", "8k"): 28,
+    ("fsLR", "32k"): 57,
+    ("fsLR", "164k"): 128,
+    ("civet", "41k"): 64,
+    ("civet", "164k"): 128,
+}
+DENSITIES = [f"{atlas}-{density}" for atlas, density in FREQUENCIES]  # benchmark parameters
+SURFACES = ["white", "pial", "midthickness", "inflated", "veryinflated", "sphere"]
+RADIUS = 100.0
+
+_Hemispheres = namedtuple("_Hemispheres", ["L", "R"])
+
+
+def _icosahedron():
+    """vertices on the unit sphere and faces of a regular icosahedron"""
+    t = (1 + np.sqrt(5)) / 2
+    vertices = np.array(
+        [[-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0], [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t]]
+        + [[t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1]],
+        dtype=float,
+    )
+    faces = np.array(
+        [[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11], [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6]]
+        + [[7, 1, 8], [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9], [4, 9, 5], [2, 4, 11], [6, 2, 10]]
+        + [[8, 6, 7], [9, 8, 1]]
+    )
+    return vertices / np.linalg.norm(vertices, axis=1, keepdims=True), faces
+
+
+@lru_cache(maxsize=None)
+def geodesic_sphere(frequency):
+    """vertices of shape (10 * frequency**2 + 2, 3) on a sphere of radius `RADIUS` and outward-oriented faces of a
+    geodesic icosphere, subdividing each icosahedron edge into `frequency` segments"""
+    ico_vertices, ico_faces = _icosahedron()
+
+    # barycentric grid of one subdivided face, and its triangles
+    i, j = np.array([(i, j) for i in range(frequency + 1) for j in range(frequency + 1 - i)]).T
+    index = {(a, b): k for k, (a, b) in enumerate(zip(i, j))}
+    triangles = [(index[a, b], index[a + 1, b], index[a, b + 1]) for a, b in zip(i, j) if a + b < frequency]
+    triangles += [
+        (index[a + 1, b], index[a + 1, b + 1], index[a, b + 1]) for a, b in zip(i, j) if a + b < frequency - 1
+    ]
+    triangles = np.array(triangles)
+    grid = np.column_stack([i, j]) / frequency
+
+    vertices = np.concatenate(
+        [v0 + grid[:, :1] * (v1 - v0) + grid[:, 1:] * (v2 - v0) for v0, v1, v2 in ico_vertices[ico_faces]]
+    )
+    faces = np.concatenate([triangles + n * len(grid) for n in range(len(ico_faces))])
+
+    # merge vertices shared between subdivided faces, and project onto the sphere
+    vertices /= np.linalg.norm(vertices, axis=1, keepdims=True)
+    _, first, inverse = np.unique(np.round(vertices, 9), axis=0, return_index=True, return_inverse=True)
+    vertices, faces = vertices[first], inverse.ravel()[faces]
+
+    normals = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]], vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    inward = np.einsum("ij,ij->i", normals, vertices[faces[:, 0]]) < 0
+    faces[inward] = faces[inward][:, [0, 2, 1]]
+    return RADIUS * vertices, faces.astype(np.int32)
+
+
+def fetch_synthetic_atlas(atlas, density, verbose=0):
+    """drop-in replacement of `neuromaps.datasets.fetch_atlas` with geodesic icospheres for every surface, and a
+    polar cap as the medial wall"""
+    vertices, faces = geodesic_sphere(FREQUENCIES[atlas, density])
+    mesh = InMemoryMesh(coordinates=vertices, faces=faces)
+    medial = (vertices[:, 2] < 0.8 * RADIUS).astype(np.int32)
+    giftis = Bunch(**{name: _Hemispheres(mesh, mesh) for name in SURFACES})
+    giftis["medial"] = _Hemispheres(medial, medial)
+    return giftis
+
+
+def use_synthetic_atlases():
+    """load synthetic atlases in place of downloaded atlases for the rest of the process"""
+    if surface.fetch_atlas is not fetch_synthetic_atlas:
+        surface.fetch_atlas = fetch_synthetic_atlas
+        surface.load_atlas.cache_clear()
+        surface.load_graph.cache_clear()
+
+
+def make_surfaces(atlas, density, n_maps=None, seed=0):
+    """pair of surfaces of random maps on a synthetic atlas"""
+    use_synthetic_atlases()
+    n_vertices = 10 * FREQUENCIES[atlas, density] ** 2 + 2
+    shape = (n_vertices,) if n_maps is None else (n_vertices, n_maps)
+    rng = np.random.default_rng(seed)
+    X, Y = (
+        surface.Surface(
+            {"left": rng.normal(size=shape), "right": rng.normal(size=shape)},
+            atlas=atlas,
+            density=density,
+            surface="inflated",
+        )
+        for _ in range(2)
+    )
+    return X, Y
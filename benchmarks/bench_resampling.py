@@ -0,0 +1,103 @@
+import tempfile
+
+from compare_brain_maps.resampling import (
+    BootstrapResampler,
+    EigenstrapResampler,
+    PermutationResampler,
+    SubsampleResampler,
+)
+from compare_brain_maps.utils.surface import load_sphere
+
+from ._synthetic import DENSITIES, make_surfaces
+
+
+class Permutation:
+    params = (DENSITIES, [100, 1000])
+    param_names = ["atlas", "n_permutations"]
+    timeout = 600
+
+    def setup(self, atlas, n_permutations):
+        self.X, self.Y = make_surfaces(*atlas.split("-"))
+        self.coords, self.hemiid = load_sphere(self.X.atlas, self.X.density)
+
+    def time_gen_spinsamples(self, atlas, n_permutations):
+        PermutationResampler(n_permutations=n_permutations, seed=0)._gen_spinsamples(self.coords, self.hemiid)
+
+    def time_fit(self, atlas, n_permutations):
+        PermutationResampler(n_permutations=n_permutations, seed=0).fit(self.X, self.Y)
+
+    def peakmem_fit(self, atlas, n_permutations):
+        PermutationResampler(n_permutations=n_permutations, seed=0).fit(self.X, self.Y)
+
+
+class PermutationCached:
+    """scoring of precomputed spins, memory-mapped from the on-disk cache"""
+
+    params = (DENSITIES, [100, 1000])
+    param_names = ["atlas", "n_permutations"]
+    timeout = 600
+
+    def setup(self, atlas, n_permutations):
+        self.X, self.Y = make_surfaces(*atlas.split("-"))
+        self.cache_dir = tempfile.TemporaryDirectory()
+        PermutationResampler(n_permutations=n_permutations, seed=0, cache_dir=self.cache_dir.name).fit(self.X, self.Y)
+
+    def teardown(self, atlas, n_permutations):
+        self.cache_dir.cleanup()
+
+    def time_fit(self, atlas, n_permutations):
+        PermutationResampler(n_permutations=n_permutations, seed=0, cache_dir=self.cache_dir.name).fit(self.X, self.Y)
+
+
+class Subsample:
+    params = (DENSITIES, [100, 1000])
+    param_names = ["atlas", "n_subsamples"]
+    timeout = 600
+
+    def setup(self, atlas, n_subsamples):
+        self.X, self.Y = make_surfaces(*atlas.split("-"))
+
+    def time_get_patches(self, atlas, n_subsamples):
+        SubsampleResampler(n_subsamples=n_subsamples, seed=0)._get_patches(self.X)
+
+    def time_get_patches_radius(self, atlas, n_subsamples):
+        SubsampleResampler(n_subsamples=n_subsamples, patch_radius=15.0, seed=0)._get_patches(self.X)
+
+    def time_fit(self, atlas, n_subsamples):
+        SubsampleResampler(n_subsamples=n_subsamples, seed=0).fit(self.X, self.Y)
+
+    def peakmem_fit(self, atlas, n_subsamples):
+        SubsampleResampler(n_subsamples=n_subsamples, seed=0).fit(self.X, self.Y)
+
+
+class Bootstrap:
+    params = (DENSITIES, [100, 1000])
+    param_names = ["atlas", "n_bootstraps"]
+    timeout = 600
+
+    def setup(self, atlas, n_bootstraps):
+        self.X, self.Y = make_surfaces(*atlas.split("-"))
+
+    def time_fit(self, atlas, n_bootstraps):
+        BootstrapResampler(n_bootstraps=n_bootstraps, seed=0).fit(self.X, self.Y)
+
+    def peakmem_fit(self, atlas, n_bootstraps):
+        BootstrapResampler(n_bootstraps=n_bootstraps, seed=0).fit(self.X, self.Y)
+
+
+class Eigenstrap:
+    """surrogates from eigenpairs computed once in `setup`"""
+
+    params = (DENSITIES, [100, 1000])
+    param_names = ["atlas", "n_surrogates"]
+    timeout = 1200
+
+    def setup(self, atlas, n_surrogates):
+        self.X, self.Y = make_surfaces(*atlas.split("-"))
+        self.resampler = EigenstrapResampler(n_surrogates=n_surrogates, n_modes=200, seed=0).fit(self.X, self.Y)
+
+    def time_fit(self, atlas, n_surrogates):
+        self.resampler.fit(self.X, self.Y)
+
+    def peakmem_fit(self, atlas, n_surrogates):
+        self.resampler.fit(self.X, self.Y)
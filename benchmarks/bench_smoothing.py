@@ -0,0 +1,60 @@
+from compare_brain_maps.smoothing import GaussianKernelSmoother, HeatKernelSmoother, NearestNeighborSmoother
+from compare_brain_maps.smoothing.gaussian_kernel import _gaussian_kernel
+from compare_brain_maps.utils.surface import load_graph
+
+from ._synthetic import DENSITIES, make_surfaces
+
+
+class HeatKernel:
+    """smoothing with eigenpairs computed once in `setup`, or without eigenpairs by chebyshev expansion"""
+
+    params = (DENSITIES, ["eigen", "chebyshev"])
+    param_names = ["atlas", "method"]
+    timeout = 1200
+
+    def setup(self, atlas, method):
+        self.X, _ = make_surfaces(*atlas.split("-"), n_maps=10)
+        self.smoother = HeatKernelSmoother(sigma=1.0, n_modes=200, method=method, seed=0).fit(self.X)
+        self.smoother.transform(self.X)
+
+    def time_transform(self, atlas, method):
+        self.smoother.transform(self.X)
+
+    def peakmem_transform(self, atlas, method):
+        self.smoother.transform(self.X)
+
+
+class NearestNeighbor:
+    params = DENSITIES
+    param_names = ["atlas"]
+
+    def setup(self, atlas):
+        self.X, _ = make_surfaces(*atlas.split("-"), n_maps=10)
+        self.smoother = NearestNeighborSmoother().fit(self.X)
+
+    def time_transform(self, atlas):
+        self.smoother.transform(self.X)
+
+    def peakmem_transform(self, atlas):
+        self.smoother.transform(self.X)
+
+
+class GaussianKernel:
+    params = DENSITIES
+    param_names = ["atlas"]
+    timeout = 600
+
+    def setup(self, atlas):
+        self.X, _ = make_surfaces(*atlas.split("-"), n_maps=10)
+        self.A = load_graph(self.X.atlas, self.X.density, self.X.surface, self.X.mask_medial)["left"]
+        self.coords = self.X.mesh.parts["left"].coordinates
+        self.smoother = GaussianKernelSmoother(fwhm=6.0).fit(self.X)
+
+    def time_kernel(self, atlas):
+        _gaussian_kernel(self.A, self.coords, fwhm=6.0, truncate=3.0, n_jobs=1)
+
+    def time_transform(self, atlas):
+        self.smoother.transform(self.X)
+
+    def peakmem_transform(self, atlas):
+        self.smoother.transform(self.X)
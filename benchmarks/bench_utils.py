@@ -0,0 +1,22 @@
+from compare_brain_maps.utils import surface
+
+from ._synthetic import DENSITIES, use_synthetic_atlases
+
+
+class Graph:
+    params = DENSITIES
+    param_names = ["atlas"]
+
+    def setup(self, atlas):
+        use_synthetic_atlases()
+        mesh, medial = surface.load_atlas(*atlas.split("-"), "inflated")
+        self.faces, self.mask = mesh.parts["left"].faces, medial.parts["left"]
+
+    def time_adjacency(self, atlas):
+        surface._adjacency(self.faces)
+
+    def time_adjacency_masked(self, atlas):
+        surface._adjacency(self.faces, self.mask)
+
+    def peakmem_adjacency(self, atlas):
+        surface._adjacency(self.faces)
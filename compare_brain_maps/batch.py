@@ -0,0 +1,277 @@
+"""batch comparison of map pairs from a manifest, sharded across a process pool.
+
+The spins or patches are generated once and shared by all workers through shared memory, and results are
+written as one `.npz` file per chunk of pairs, so an interrupted run resumes from the missing chunks.
+
+Examples
+--------
+A manifest is a csv file with one pair of maps per row, and columns `x_left`, `x_right`, `y_left` and `y_right` of
+files readable by `nilearn.surface.load_surf_data` (and an optional `id` column)::
+
+    compare-brain-maps-batch manifest.csv results/ --method permutation --n-draws 1000 --n-jobs 8
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+
+from .resampling import PermutationResampler, SubsampleResampler
+from .resampling._base import _rows_key
+from .utils.surface import Surface, load_atlas
+
+_COLUMNS = ["x_left", "x_right", "y_left", "y_right"]
+_METHODS = ["permutation", "subsample"]
+_WORKER = {}  # resampler, surface parameters and attached shared memory of each worker process
+
+
+def _resampler(method, n_draws, seed, n_jobs=1):
+    """resampler of `method`, reusing its spins or patches across calls to `fit`"""
+    if method == "permutation":
+        return PermutationResampler(n_permutations=n_draws, seed=seed, n_jobs=n_jobs)
+    return SubsampleResampler(n_subsamples=n_draws, seed=seed)
+
+
+def _null_arrays(resampler, X):
+    """spins (an array) or patches (the arrays of a csr matrix) of `resampler` for surfaces like `X`"""
+    if isinstance(resampler, PermutationResampler):
+        return {"spins": resampler._get_spins(X)}
+    patches = resampler._get_patches(X)
+    return {
+        "data": patches.data,
+        "indices": patches.indices,
+        "indptr": patches.indptr,
+        "shape": np.array(patches.shape),
+    }
+
+
+def _share(arrays):
+    """copy arrays into shared memory blocks, returning the blocks and the specs to attach them"""
+    blocks, specs = [], {}
+    for name, arr in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[...] = arr
+        blocks.append(block)
+        specs[name] = (block.name, arr.shape, arr.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs):
+    """read-only views of arrays in shared memory, and their blocks to keep alive"""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        # workers share the resource tracker of the creating process, which unlinks the block once the run ends
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+        blocks.append(block)
+    return blocks, arrays
+
+
+def _init_worker(method, n_draws, seed, specs, key, surface_kwargs):
+    """build the resampler of a worker process around the shared spins or patches of the rows of `key`"""
+    blocks, arrays = _attach(specs)
+    resampler = _resampler(method, n_draws, seed)
+    if method == "permutation":
+        resampler._spins, resampler._spins_key = arrays["spins"], key
+    else:
+        resampler._patches = sparse.csr_array(
+            (arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(arrays["shape"])
+        )
+        resampler._patches_key = key
+    _WORKER.update(resampler=resampler, blocks=blocks, surface_kwargs=surface_kwargs)
+
+
+def _run_chunk(path, rows):
+    """compare each pair of maps of `rows` and write the results of the chunk to `path`"""
+    resampler, surface_kwargs = _WORKER["resampler"], _WORKER["surface_kwargs"]
+    ids, param, null, params = [], [], [], []
+    for row in rows:
+        X = Surface({"left": row["x_left"], "right": row["x_right"]}, **surface_kwargs)
+        Y = Surface({"left": row["y_left"], "right": row["y_right"]}, **surface_kwargs)
+        resampler.fit(X, Y)
+        ids.append(row["id"])
+        param.append(resampler.param_)
+        null.append(resampler.null_)
+        params.append(resampler.params_)
+
+    # written under a temporary name and renamed, so a chunk file is either complete or missing
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, id=np.array(ids), param=np.array(param), null=np.array(null), params=np.stack(params))
+    os.replace(tmp, path)
+    return path
+
+
+def read_manifest(manifest):
+    """rows of a csv manifest of map pairs, as dicts with keys `id`, `x_left`, `x_right`, `y_left` and `y_right`"""
+    with open(manifest, newline="") as f:
+        rows = list(csv.DictReader(f))
+    missing = set(_COLUMNS) - set(rows[0] if rows else _COLUMNS)
+    if missing:
+        raise ValueError(f"manifest is missing columns {sorted(missing)}")
+    for i, row in enumerate(rows):
+        row.setdefault("id", str(i))
+    return rows
+
+
+def load_results(output_dir):
+    """results of a batch run concatenated over its chunks, in manifest order.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        `id` (n_pairs,), `param` (n_pairs,), `null` (n_pairs,) and `params` (n_pairs, n_draws) of the pairs of the
+        chunks written so far
+    """
+    paths = sorted(glob.glob(os.path.join(output_dir, "chunk-*.npz")))
+    if not paths:
+        raise ValueError(f"no results in {output_dir}")
+    chunks = [dict(np.load(path)) for path in paths]
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+
+def run_batch(
+    manifest,
+    output_dir,
+    method="permutation",
+    n_draws=1000,
+    atlas="fsaverage",
+    density="3k",
+    surface="pial",
+    mask_medial=False,
+    chunk_size=16,
+    n_jobs=1,
+    seed=0,
+    verbose=False,
+):
+    """Compare every pair of maps of a manifest, sharded across a process pool sharing one set of spins or patches.
+
+    Parameters
+    ----------
+    manifest : str or pathlib.Path
+        csv file of map pairs (see `read_manifest`)
+    output_dir : str or pathlib.Path
+        directory of the results, one `chunk-*.npz` file per chunk of pairs (see `load_results`); chunks already
+        written by a run with the same parameters are skipped
+    method : str, optional
+        one of `{"permutation", "subsample"}`, by default "permutation"
+    n_draws : int, optional
+        number of permutations or subsamples, by default 1000
+    atlas, density, surface, mask_medial : optional
+        parameters of the `Surface` of every map
+    chunk_size : int, optional
+        number of pairs per task and per result file, by default 16
+    n_jobs : int, optional
+        number of worker processes, by default 1
+    seed : int, optional
+        seed of the spins or patches shared by all pairs, by default 0
+    verbose : bool, optional
+        print the progress of the chunks, by default False
+
+    Returns
+    -------
+    list of str
+        paths of the chunks written by this call
+    """
+    if method not in _METHODS:
+        raise ValueError(f"method must be one of {_METHODS}, got {method}")
+    rows = read_manifest(manifest)
+    surface_kwargs = dict(atlas=atlas, density=density, surface=surface, mask_medial=mask_medial)
+
+    # parameters of a run are fixed once its first chunk may exist, so that resumed chunks are comparable
+    config = dict(
+        manifest=os.path.abspath(manifest),
+        n_pairs=len(rows),
+        method=method,
+        n_draws=n_draws,
+        chunk_size=chunk_size,
+        seed=seed,
+        **surface_kwargs,
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    config_path = os.path.join(output_dir, "run.json")
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            stored = json.load(f)
+        if stored != config:
+            raise ValueError(f"{output_dir} holds a run with other parameters: {stored}")
+    else:
+        with open(config_path, "w") as f:
+            json.dump(config, f, indent=2)
+
+    chunks = {
+        os.path.join(output_dir, f"chunk-{i // chunk_size:06d}.npz"): rows[i : i + chunk_size]
+        for i in range(0, len(rows), chunk_size)
+    }
+    pending = {path: chunk for path, chunk in chunks.items() if not os.path.exists(path)}
+    if verbose:
+        print(f"{len(chunks) - len(pending)}/{len(chunks)} chunks already written")
+    if not pending:
+        return []
+
+    # spins or patches generated once, on surfaces of the atlas
+    mesh, _ = load_atlas(atlas, density, surface)
+    X = Surface({hemi: np.zeros(mesh.parts[hemi].n_vertices) for hemi in ["left", "right"]}, **surface_kwargs)
+    blocks, specs = _share(_null_arrays(_resampler(method, n_draws, seed, n_jobs=-1), X))
+
+    written = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(method, n_draws, seed, specs, _rows_key(X), surface_kwargs),
+        ) as pool:
+            futures = [pool.submit(_run_chunk, path, chunk) for path, chunk in pending.items()]
+            for future in as_completed(futures):
+                written.append(future.result())
+                if verbose:
+                    print(f"{len(chunks) - len(pending) + len(written)}/{len(chunks)} chunks written")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return sorted(written)
+
+
+def main(argv=None):
+    """command line entry point of `run_batch`"""
+    parser = argparse.ArgumentParser(prog="compare-brain-maps-batch", description=run_batch.__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="csv file with columns x_left, x_right, y_left, y_right (and optional id)")
+    parser.add_argument("output_dir", help="directory of the resumable chunk-*.npz results")
+    parser.add_argument("--method", choices=_METHODS, default="permutation")
+    parser.add_argument("--n-draws", type=int, default=1000, help="number of permutations or subsamples")
+    parser.add_argument("--atlas", default="fsaverage")
+    parser.add_argument("--density", default="3k")
+    parser.add_argument("--surface", default="pial")
+    parser.add_argument("--mask-medial", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=16, help="number of pairs per result file")
+    parser.add_argument("--n-jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    run_batch(
+        args.manifest,
+        args.output_dir,
+        method=args.method,
+        n_draws=args.n_draws,
+        atlas=args.atlas,
+        density=args.density,
+        surface=args.surface,
+        mask_medial=args.mask_medial,
+        chunk_size=args.chunk_size,
+        n_jobs=args.n_jobs,
+        seed=args.seed,
+        verbose=not args.quiet,
+    )
+
+
+if __name__ == "__main__":
+    main()
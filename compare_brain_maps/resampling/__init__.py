@@ -1,7 +1,8 @@
 """resampling estimators"""
 
 from .bootstrap import BootstrapResampler
+from .eigenstrapping import EigenstrapResampler
 from .permutation import PermutationResampler
 from .subsample import SubsampleResampler
 
-__all__ = ["BootstrapResampler", "SubsampleResampler", "PermutationResampler"]
+__all__ = ["BootstrapResampler", "EigenstrapResampler", "SubsampleResampler", "PermutationResampler"]
@@ -1,7 +1,240 @@
 import numpy as np
+from scipy import stats
+
+from ..utils._cache import hash_arrays
+from ..utils.surface import load_sphere
+from ..utils.volume import Volume
+
+_CONFIDENCE = 0.999  # confidence of the bounds on the quantile position that stop sequential resampling
+_CALLBACK_CHUNK_SIZE = 100  # null draws scored between two calls to a callback, in batches of more draws
+
+
+def _combine(X):
+    """data of both hemispheres (or every part of a volume) combined, of the cortical vertices only if the medial wall
+    is masked, or of the parcel means if `X` is parcellated, as floats so that resampled maps can be centered in place
+    (e.g. of integer label or count maps)"""
+    data = X.compress() if X.parcellation is None else X.parcellate()
+    return np.concatenate(list(data.values()), dtype=float)
+
+
+def _rows_key(X):
+    """key of the rows of `_combine(X)` and of their geometry, which spins, patches and blocks reused across calls to
+    `fit` must match"""
+    if isinstance(X, Volume):
+        return ("volume", hash_arrays(X.mask, X.affine), X.connectivity)
+    return (X.atlas, X.density, X.surface, X.mask_medial, X._parcellation_key)
+
+
+def _sphere(X):
+    """sphere coordinates and hemisphere labels of the rows of `_combine(X)`: the vertices, or the parcel centroids"""
+    if X.parcellation is None:
+        return load_sphere(X.atlas, X.density, X.mask_medial)
+    centroids = X.get_parcel_centroids("sphere")
+    coords = np.concatenate([centroids["left"], centroids["right"]])
+    hemiid = np.repeat([0, 1], [len(centroids["left"]), len(centroids["right"])])
+    return coords, hemiid
+
+
+def _graph(X):
+    """adjacency matrices and coordinates per hemisphere (or part of a volume) of the rows of `_combine(X)`: the
+    vertices or voxels, or the parcels"""
+    if X.parcellation is None:
+        return X.get_adjacency(compact=True), X.get_coordinates()
+    return X.get_parcel_adjacency(), X.get_parcel_centroids()
 
 
 def quantile_test(param_, params_, alpha=0.05):
     """test whether `param_` is inside the (alpha/2, 1-alpha/2) quantile interval."""
-    lwr, upr = np.quantile(params_, [alpha / 2, 1 - alpha / 2])
-    return bool(lwr <= param_ <= upr)
+    lwr, upr = np.quantile(params_, [alpha / 2, 1 - alpha / 2], axis=-1)
+    null_ = (lwr <= param_) & (param_ <= upr)
+    return bool(null_) if np.ndim(null_) == 0 else null_
+
+
+def _settled(param_, params_, alpha=0.05):
+    """True where a Clopper-Pearson confidence interval of the quantile position of `param_` in the null distribution
+    lies entirely inside or entirely outside the (alpha/2, 1-alpha/2) interval, so more draws would not change
+    the decision of `quantile_test`"""
+    n = params_.shape[-1]
+    k = np.sum(params_ <= np.expand_dims(param_, -1), axis=-1)
+    tail = (1 - _CONFIDENCE) / 2
+    with np.errstate(invalid="ignore"):
+        lwr = np.where(k > 0, stats.beta.ppf(tail, k, n - k + 1), 0.0)
+        upr = np.where(k < n, stats.beta.ppf(1 - tail, k + 1, n - k), 1.0)
+    inside = (alpha / 2 <= lwr) & (upr <= 1 - alpha / 2)
+    outside = (upr < alpha / 2) | (1 - alpha / 2 < lwr)
+    return inside | outside
+
+
+def _sequential_null(score, param_, n_draws, batch_size=None, alpha=0.05):
+    """null draws scored in batches until the quantile test of every pair of maps is settled.
+
+    Parameters
+    ----------
+    score : callable
+        function mapping draws `start, ..., stop - 1` to an ndarray of shape ([n_X, n_Y,] stop - start) of nulls
+    param_ : float or ndarray of shape (n_X, n_Y)
+        observed map-to-map correlations
+    n_draws : int
+        maximum number of null draws
+    batch_size : int, optional
+        number of null draws per batch (`None` scores all `n_draws` at once), by default None
+    alpha : float, optional
+        significance level for the quantile test, by default 0.05
+
+    Returns
+    -------
+    ndarray of shape ([n_X, n_Y,] n_used)
+        nulls of the first `n_used <= n_draws` draws
+    """
+    if batch_size is None:
+        return score(0, n_draws)
+    batches, stop = [], 0
+    while stop < n_draws:
+        start, stop = stop, min(stop + batch_size, n_draws)
+        batches.append(score(start, stop))
+        params_ = np.concatenate(batches, axis=-1)
+        if np.all(_settled(param_, params_, alpha)):
+            break
+    return params_
+
+
+def _callback_chunks(start, stop, callback=None):
+    """slices of the null draws `start, ..., stop - 1` scored between calls to `callback`, or one slice without"""
+    step = max(stop - start, 1) if callback is None else _CALLBACK_CHUNK_SIZE
+    return [slice(i, min(i + step, stop)) for i in range(start, stop, step)]
+
+
+def _get_chunk_size(bytes_per_column, n_columns, chunk_size=None, max_memory=None, fixed_bytes=0):
+    """number of resampled maps (columns) scored per chunk, set directly or from a memory budget in megabytes that
+    also holds `fixed_bytes` allocated whatever the chunk size"""
+    if chunk_size is not None:
+        return int(max(1, min(chunk_size, n_columns)))
+    if max_memory is None:
+        return n_columns
+    return int(max(1, min((max_memory * 2**20 - fixed_bytes) // bytes_per_column, n_columns)))
+
+
+def _corr_bytes(X_n, Y_n, n_columns):
+    """bytes of the centered copy of `Y_n`, of the correlations of `n_columns` resampled maps and of the buffers of
+    numpy's ufuncs and fancy indexing, allocated by `_chunked_corr` whatever the chunk size"""
+    n_buffer = 2 * np.getbufsize()
+    return 8 * (Y_n.size + X_n.size // len(X_n) * (Y_n.size // len(Y_n)) * n_columns + n_buffer)
+
+
+def _center(X):
+    """center columns of `X`, returning the centered array and column norms"""
+    X_c = X - X.mean(axis=0)
+    return X_c, np.linalg.norm(X_c, axis=0)
+
+
+def _pairwise_corr(X, Y):
+    """correlations between every column of `X` of shape (n_rows, n_X) and of `Y` of shape (n_rows, n_Y)"""
+    X_c, x_norm = _center(X)
+    Y_c, y_norm = _center(Y)
+    return (X_c.T @ Y_c) / np.outer(x_norm, y_norm)
+
+
+def _chunked_corr(gather, y, n_columns, chunk_size, callback=None):
+    """correlate `y` with `n_columns` resampled maps, gathered and scored one chunk at a time.
+
+    Parameters
+    ----------
+    gather : callable
+        function mapping a slice of column indices to a new ndarray of shape (n_rows, n_chunk[, n_X]) of resampled
+        maps, which is centered in place
+    y : ndarray of shape (n_rows[, n_Y])
+        fixed map(s), centered once and reused for every chunk
+    n_columns : int
+        total number of resampled maps
+    chunk_size : int
+        number of resampled maps per chunk
+    callback : callable, optional
+        function called with the number of resampled maps scored so far after each chunk, by default None
+
+    Returns
+    -------
+    ndarray of shape ([n_X, n_Y,] n_columns)
+        correlation of `y` with each resampled map
+    """
+    y_c, y_norm = _center(y)
+    params_ = None
+    for start in range(0, n_columns, chunk_size):
+        cols = slice(start, min(start + chunk_size, n_columns))
+        # the gathered chunk is the only array of its size: centered in place, normed without a squared copy, and
+        # released before the next chunk is gathered
+        X_c = gather(cols)
+        X_c -= X_c.mean(axis=0)
+        x_norm = np.sqrt(np.einsum("i...,i...->...", X_c, X_c))
+        rho = np.tensordot(X_c, y_c, axes=(0, 0)) / np.multiply.outer(x_norm, y_norm)
+        del X_c
+        if params_ is None:
+            params_ = np.empty(rho.shape[1:] + (n_columns,))
+        params_[..., cols] = np.moveaxis(rho, 0, -1)
+        if callback is not None:
+            callback(cols.stop)
+    return params_
+
+
+def _stat_maps(X, Y):
+    """standardized `X` and `Y`, their squares and the cross-products of each column of `X` with `Y`, whose sums
+    weighted by each row of `W` are the sufficient statistics of `_sufficient_stats`.
+
+    Returns
+    -------
+    tuple of ndarray
+        X (n_rows, n_X), Y (n_rows, n_Y), X**2 (n_rows, n_X), Y**2 (n_rows, n_Y) and XY (n_rows, n_X, n_Y)
+    """
+    # standardize so that the sufficient statistics do not suffer from cancellation
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    Y = (Y - Y.mean(axis=0)) / Y.std(axis=0)
+    return X, Y, X**2, Y**2, X[:, :, None] * Y[:, None, :]
+
+
+def _sufficient_stats(W, X, Y, maps=None):
+    """weighted count, sums, sums of squares and cross-products of standardized `X` and `Y` for each row of `W`.
+
+    Parameters
+    ----------
+    W : ndarray or scipy.sparse array of shape (n_weights, n_rows)
+        non-negative weights, e.g. a binary membership matrix of patches
+    X : ndarray of shape (n_rows, n_X)
+        maps to correlate with `Y`
+    Y : ndarray of shape (n_rows, n_Y)
+        maps to correlate with `X`
+    maps : tuple of ndarray, optional
+        `_stat_maps(X, Y)`, computed once if `W` is weighted in chunks, by default None
+
+    Returns
+    -------
+    tuple of ndarray
+        m (n_weights,), Sx (n_weights, n_X), Sy (n_weights, n_Y), Sxx (n_weights, n_X), Syy (n_weights, n_Y) and
+        Sxy (n_weights, n_X, n_Y), which are additive over rows of `W`
+    """
+    X, Y, XX, YY, XY = _stat_maps(X, Y) if maps is None else maps
+    m = np.asarray(W.sum(axis=1)).ravel()
+    Sxy = (W @ XY.reshape(len(XY), -1)).reshape((W.shape[0],) + XY.shape[1:])
+    return m, W @ X, W @ Y, W @ XX, W @ YY, Sxy
+
+
+def _corr_from_stats(m, Sx, Sy, Sxx, Syy, Sxy):
+    """correlations of shape (n_X, n_Y, n_weights) from the sufficient statistics of `_sufficient_stats`"""
+    m = m[:, None]
+    Vx = Sxx - Sx**2 / m
+    Vy = Syy - Sy**2 / m
+    Cxy = Sxy - Sx[:, :, None] * Sy[:, None, :] / m[:, :, None]
+    return np.moveaxis(Cxy / np.sqrt(Vx[:, :, None] * Vy[:, None, :]), 0, -1)
+
+
+def _weighted_corr(W, X, Y, maps=None):
+    """correlations between every column of `X` and of `Y`, weighted by each row of `W`, from sufficient statistics
+    (of `maps`, see `_sufficient_stats`).
+
+    Returns
+    -------
+    ndarray of shape (n_X, n_Y, n_weights)
+        weighted correlations
+    ndarray of shape (n_weights,)
+        total weight of each row of `W`
+    """
+    stats = _sufficient_stats(W, X, Y, maps)
+    return _corr_from_stats(*stats), stats[0]
@@ -1,5 +1,170 @@
+import numpy as np
+from scipy import sparse, spatial
 from sklearn.base import BaseEstimator
+from sklearn.utils import check_random_state
+
+from ..utils._profile import profile, stage
+from ._base import (
+    _callback_chunks,
+    _combine,
+    _corr_from_stats,
+    _pairwise_corr,
+    _rows_key,
+    _sphere,
+    _sufficient_stats,
+    quantile_test,
+)
 
 
 class BootstrapResampler(BaseEstimator):
-    pass
+    """Resampling by a spatial block bootstrap, resampling contiguous blocks of vertices with replacement.
+
+    Each bootstrap replicate is a vector of multinomial counts over blocks, and its correlation is computed from
+    the count-weighted sums of per-block sufficient statistics, without materializing resampled maps.
+
+    Parameters
+    ----------
+    n_bootstraps : int, optional
+        number of bootstrap replicates, by default 1000
+    n_blocks : int, optional
+        number of spatial blocks per hemisphere, at most the number of vertices (or parcels) of each hemisphere, by
+        default 100
+    alpha : float, optional
+        significance level for the quantile test, by default 0.05
+    reuse_blocks : bool, optional
+        reuse blocks across sequential calls to `fit`, by default True
+    callback : callable, optional
+        called as `callback(n_done, n_bootstraps)` after each chunk of at most 100 bootstrap replicates is scored,
+        e.g. to report progress or to stop a run by raising an exception, by default None
+    seed : None, int or instance of RandomState, optional
+        seed for the random state generator, by default None
+
+    Attributes
+    ----------
+    param_ : float or ndarray of shape (n_X, n_Y)
+        map-to-map correlation across both hemispheres combined
+    params_ : ndarray of shape ([n_X, n_Y,] n_bootstraps)
+        deviations of bootstrapped map-to-map correlations from `param_`
+    null_ : bool or ndarray of shape (n_X, n_Y)
+        True if `param_` falls inside the central quantile interval
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last fit: loading
+        the sphere ("sphere"), partitioning it into blocks ("blocks") and correlating replicates ("correlation")
+
+    References
+    ----------
+    .. [1] Künsch. The Jackknife and the Bootstrap for General Stationary Observations. The Annals of Statistics
+        (1989)
+    """
+
+    def __init__(self, n_bootstraps=1000, n_blocks=100, alpha=0.05, reuse_blocks=True, callback=None, seed=None):
+        super().__init__()
+        self.n_bootstraps = n_bootstraps
+        self.n_blocks = n_blocks
+        self.alpha = alpha
+        self.reuse_blocks = reuse_blocks
+        self.callback = callback
+        self.seed = seed
+
+    def _block_vertices(self, X, rng):
+        """sparse membership matrix of shape (2 * n_blocks, n_vertices) of voronoi cells of random vertices on the
+        sphere, per hemisphere"""
+        with stage("sphere"):
+            coords, hemiid = _sphere(X)
+        n_rows = np.bincount(hemiid, minlength=2).min()
+        if self.n_blocks > n_rows:
+            raise ValueError(
+                f"n_blocks must be at most the number of vertices (or parcels) of each hemisphere, got {self.n_blocks} "
+                f"and {n_rows}"
+            )
+        labels = np.empty(len(coords), dtype=np.int64)
+        for h in range(2):
+            mask = hemiid == h
+            seeds = rng.choice(mask.sum(), size=self.n_blocks, replace=False)
+            _, labels[mask] = spatial.cKDTree(coords[mask][seeds]).query(coords[mask], k=1)
+            labels[mask] += h * self.n_blocks
+        return sparse.csr_array(
+            (np.ones(len(coords), dtype=bool), (labels, np.arange(len(coords)))), shape=(2 * self.n_blocks, len(coords))
+        )
+
+    def _get_blocks(self, X, rng):
+        key = (_rows_key(X), self.n_blocks)  # blocks of other rows (e.g. another medial wall mask) are redrawn
+        if self.reuse_blocks and hasattr(self, "_blocks") and self._blocks_key == key:
+            return self._blocks
+        with stage("blocks"):
+            blocks = self._block_vertices(X, rng)
+        if self.reuse_blocks:
+            self._blocks, self._blocks_key = blocks, key
+        return blocks
+
+    def _bootstrap(self, block_stats, counts):
+        """bootstrapped correlations of shape (n_X, n_Y, n_replicates) from replicate counts of each block"""
+        # per-block sufficient statistics, summed with the multinomial counts of each block per replicate
+        stats = [(counts @ s.reshape(len(s), -1)).reshape((len(counts),) + s.shape[1:]) for s in block_stats]
+        return _corr_from_stats(*stats)
+
+    def fit(self, X, Y):
+        """Fit BootstrapResampler.
+
+        Parameters
+        ----------
+        X : Surface
+            surface object containing the data and mesh for both hemispheres
+        Y : Surface
+            surface object containing the data and mesh for both hemispheres
+        """
+        # check X, Y are same surface
+        if X.shape != Y.shape:
+            raise ValueError(f"X and Y must have the same shape. X: {X.shape}, Y: {Y.shape}")
+
+        self.fit_many(X, Y)
+        self.param_ = self.param_[0, 0]
+        self.params_ = self.params_[0, 0]
+        self.null_ = bool(self.null_[0, 0])
+        return self
+
+    def fit_many(self, X, Y):
+        """Fit BootstrapResampler on every pair of maps from two stacks, sharing one set of blocks and replicates.
+
+        Parameters
+        ----------
+        X : Surface
+            surface object containing `n_X` maps as data of shape (n_vertices, n_X) for both hemispheres
+        Y : Surface
+            surface object containing `n_Y` maps as data of shape (n_vertices, n_Y) for both hemispheres
+        """
+        # check X, Y are same surface
+        if X.shape[0] != Y.shape[0]:
+            raise ValueError(f"X and Y must have the same number of vertices. X: {X.shape}, Y: {Y.shape}")
+
+        # combine hemispheres, as stacks of maps
+        X_n = _combine(X)
+        X_n = X_n.reshape(len(X_n), -1)
+        Y_n = _combine(Y)
+        Y_n = Y_n.reshape(len(Y_n), -1)
+
+        # full-map correlations across hemispheres
+        rho_n_ = _pairwise_corr(X_n, Y_n)
+
+        # block bootstrap correlations across hemispheres, timed per stage
+        rng = check_random_state(self.seed)
+        n_blocks = 2 * self.n_blocks
+        counts = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=self.n_bootstraps)
+        with profile() as timings:
+            blocks = self._get_blocks(X, rng)
+            with stage("correlation"):
+                block_stats = _sufficient_stats(blocks, X_n, Y_n)
+            params_ = []
+            for chunk in _callback_chunks(0, self.n_bootstraps, self.callback):
+                with stage("correlation"):
+                    params_.append(self._bootstrap(block_stats, counts[chunk]) - rho_n_[..., None])
+                if self.callback is not None:
+                    self.callback(chunk.stop, self.n_bootstraps)
+            params_ = np.concatenate(params_, axis=-1)
+
+        self.param_ = rho_n_
+        self.params_ = params_
+        self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.timings_ = timings
+
+        return self
@@ -0,0 +1,210 @@
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.utils import check_random_state
+
+from ..utils._eigen import load_mesh_eigenpairs
+from ..utils._profile import profile, stage
+from ._base import _chunked_corr, _combine, _corr_bytes, _get_chunk_size, _pairwise_corr, quantile_test
+
+
+def _eigen_groups(n_modes):
+    """slices of eigen-groups of sizes 3, 5, 7, ... (the spherical harmonic degrees l = 1, 2, ...), truncated to the
+    complete groups among the first `n_modes` non-constant modes"""
+    groups, start, size = [], 0, 3
+    while start + size <= n_modes:
+        groups.append(slice(start, start + size))
+        start, size = start + size, size + 2
+    return groups
+
+
+def _random_orthogonal(rng, n, size):
+    """`n` random orthogonal matrices of shape (size, size), uniformly distributed over O(size)"""
+    Q, R = np.linalg.qr(rng.normal(size=(n, size, size)))
+    return Q * np.sign(np.diagonal(R, axis1=1, axis2=2))[:, None, :]
+
+
+def _rotate_coefficients(beta, groups, n_surrogates, rng):
+    """modal coefficients of shape (n_modes, n_surrogates, n_X) of surrogate maps, rotating the coefficients `beta` of
+    shape (n_modes, n_X) within each eigen-group, with one rotation per surrogate shared by all maps"""
+    coeffs = np.empty((groups[-1].stop, n_surrogates, beta.shape[1]))
+    for group in groups:
+        rot = _random_orthogonal(rng, n_surrogates, group.stop - group.start)  # (n_surrogates, size, size)
+        coeffs[group] = np.moveaxis(rot @ beta[group], 0, 1)
+    return coeffs
+
+
+class EigenstrapResampler(BaseEstimator):
+    """Resampling by randomly rotating the Laplace-Beltrami eigenmode coefficients of a map ("Eigenstrapping").
+
+    Each map is projected once onto the eigenmodes of its hemisphere, and surrogate maps are reconstructed from the
+    coefficients rotated within each eigen-group of sizes 3, 5, 7, ..., which preserves the power of every group
+    without a spherical projection of the mesh.
+
+    Parameters
+    ----------
+    n_surrogates : int, optional
+        number of surrogate maps, by default 1000
+    n_modes : int, optional
+        number of non-constant eigenmodes, truncated to the complete eigen-groups, by default 500
+    alpha : float, optional
+        significance level for the quantile test, by default 0.05
+    reuse_eigenpairs : bool, optional
+        reuse eigenpairs across sequential calls to `fit`, by default True
+    chunk_size : int, optional
+        number of surrogates reconstructed and scored per chunk, overrides `max_memory` if set, by default None
+    max_memory : float, optional
+        memory budget in megabytes for each chunk of surrogate maps (`None` scores all at once), by default 1024
+    cache_dir : str or pathlib.Path, optional
+        directory of eigenpairs persisted across processes and memory-mapped on load, by default None
+    callback : callable, optional
+        called as `callback(n_done, n_surrogates)` after each chunk of surrogates is scored, e.g. to report
+        progress or to stop a run by raising an exception, by default None
+    seed : None, int or instance of RandomState, optional
+        seed for the random state generator, by default None
+
+    Attributes
+    ----------
+    param_ : float or ndarray of shape (n_X, n_Y)
+        map-to-map correlation across both hemispheres combined
+    params_ : ndarray of shape ([n_X, n_Y,] n_surrogates)
+        surrogate map-to-map correlations across both hemispheres combined
+    null_ : bool or ndarray of shape (n_X, n_Y)
+        True if `param_` falls inside the central quantile interval
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last fit: computing
+        or loading eigenpairs ("eigenpairs"), projecting and rotating coefficients ("rotation") and reconstructing
+        and correlating surrogates ("correlation")
+
+    References
+    ----------
+    .. [1] Koussis, Pang, Jeganathan, Paton, Fornito, Robinson, Misic, Breakspear. Generation of surrogate brain
+        maps preserving spatial autocorrelation through random rotation of geometric eigenmodes. bioRxiv (2024)
+    """
+
+    def __init__(
+        self,
+        n_surrogates=1000,
+        n_modes=500,
+        alpha=0.05,
+        reuse_eigenpairs=True,
+        chunk_size=None,
+        max_memory=1024,
+        cache_dir=None,
+        callback=None,
+        seed=None,
+    ):
+        super().__init__()
+        self.n_surrogates = n_surrogates
+        self.n_modes = n_modes
+        self.alpha = alpha
+        self.reuse_eigenpairs = reuse_eigenpairs
+        self.chunk_size = chunk_size
+        self.max_memory = max_memory
+        self.cache_dir = cache_dir
+        self.callback = callback
+        self.seed = seed
+
+    def _get_eigenpairs(self, mesh):
+        """laplace-beltrami eigenpairs per hemisphere, or precomputed (slicing if more modes are stored)"""
+        reuse = self.reuse_eigenpairs and hasattr(self, "_eigenpairs")
+        stored = (self._eigenpairs_key, self._eigenpairs) if reuse else None
+        key, eigenpairs = load_mesh_eigenpairs(mesh, self.n_modes, stored, self.cache_dir, self.seed)
+        if self.reuse_eigenpairs:
+            self._eigenpairs, self._eigenpairs_key = eigenpairs, key
+        return eigenpairs
+
+    def fit(self, X, Y):
+        """Fit EigenstrapResampler.
+
+        Parameters
+        ----------
+        X : Surface
+            surface object containing the data and mesh for both hemispheres
+        Y : Surface
+            surface object containing the data and mesh for both hemispheres
+        """
+        # check X, Y are same surface
+        if X.shape != Y.shape:
+            raise ValueError(f"X and Y must have the same shape. X: {X.shape}, Y: {Y.shape}")
+
+        self.fit_many(X, Y)
+        self.param_ = self.param_[0, 0]
+        self.params_ = self.params_[0, 0]
+        self.null_ = bool(self.null_[0, 0])
+        return self
+
+    def fit_many(self, X, Y):
+        """Fit EigenstrapResampler on every pair of maps from two stacks, sharing one set of rotations.
+
+        Parameters
+        ----------
+        X : Surface
+            surface object containing `n_X` maps as data of shape (n_vertices, n_X) for both hemispheres
+        Y : Surface
+            surface object containing `n_Y` maps as data of shape (n_vertices, n_Y) for both hemispheres
+        """
+        # check X, Y are same surface
+        if X.shape[0] != Y.shape[0]:
+            raise ValueError(f"X and Y must have the same number of vertices. X: {X.shape}, Y: {Y.shape}")
+
+        # combine hemispheres, as stacks of maps
+        X_n = _combine(X)
+        X_n = X_n.reshape(len(X_n), -1)
+        Y_n = _combine(Y)
+        Y_n = Y_n.reshape(len(Y_n), -1)
+
+        # full-map correlations across hemispheres
+        rho_n_ = _pairwise_corr(X_n, Y_n)
+
+        # project X once onto the eigenmodes, and rotate its coefficients within each eigen-group per hemisphere
+        rng = check_random_state(self.seed)
+        groups = _eigen_groups(self.n_modes)
+        if not groups:
+            raise ValueError(f"n_modes must be at least 3 to rotate one eigen-group, got {self.n_modes}")
+        with profile() as timings:
+            # eigenmodes of the cortex mesh if the medial wall is masked
+            _, _, mesh = X.get_cortex()
+            with stage("eigenpairs"):
+                eigenpairs = self._get_eigenpairs(mesh)
+            bases, coeffs = [], []
+            X_data = X.compress()
+            if X.parcellation is not None:
+                # surrogates are reconstructed directly as parcel means, with eigenmodes averaged within parcels
+                vertices, _, _ = X.get_cortex()
+                _, P = X.get_parcels()
+            with stage("rotation"):
+                for hemi in ["left", "right"]:
+                    _, emodes, mass = eigenpairs[hemi]
+                    emodes = emodes[:, : groups[-1].stop]
+                    data = X_data[hemi]
+                    # eigenmodes are orthonormal in the inner product of the FEM mass matrix
+                    beta_ = emodes.T @ (mass @ data.reshape(data.shape[0], -1))  # (n_modes, n_X)
+                    bases.append(emodes if X.parcellation is None else P[hemi][:, vertices[hemi]] @ emodes)
+                    coeffs.append(_rotate_coefficients(beta_, groups, self.n_surrogates, rng))
+
+            # surrogates of each chunk reconstructed in one matrix product per hemisphere, written in place
+            def gather(cols):
+                out = np.empty((len(X_n), cols.stop - cols.start, X_n.shape[1]))
+                start = 0
+                for emodes, c in zip(bases, coeffs):
+                    stop = start + len(emodes)
+                    np.matmul(emodes, c[:, cols].reshape(len(c), -1), out=out[start:stop].reshape(len(emodes), -1))
+                    start = stop
+                return out
+
+            def progress(n_done):
+                self.callback(n_done, self.n_surrogates)
+
+            # float64 reconstructed surrogates per column, centered in place
+            fixed_bytes = _corr_bytes(X_n, Y_n, self.n_surrogates)
+            chunk_size = _get_chunk_size(8 * X_n.size, self.n_surrogates, self.chunk_size, self.max_memory, fixed_bytes)
+            with stage("correlation"):
+                params_ = _chunked_corr(
+                    gather, Y_n, self.n_surrogates, chunk_size, None if self.callback is None else progress
+                )
+
+        self.param_ = rho_n_
+        self.params_ = params_
+        self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.timings_ = timings
+        return self
@@ -1,11 +1,138 @@
+import numbers
+import os
+import shutil
+
 import numpy as np
-from neuromaps.datasets import fetch_atlas
-from neuromaps.nulls.spins import get_parcel_centroids
+from joblib import Parallel, delayed, effective_n_jobs
 from scipy import spatial
 from sklearn.base import BaseEstimator
 from sklearn.utils.validation import check_random_state
 
-from ._base import quantile_test
+from ..utils._cache import (
+    cache_key,
+    create_array,
+    hash_arrays,
+    list_keys,
+    load_array,
+    publish_array,
+    remove_array,
+    save_array,
+)
+from ..utils._profile import profile, stage
+from ._base import (
+    _chunked_corr,
+    _combine,
+    _corr_bytes,
+    _get_chunk_size,
+    _pairwise_corr,
+    _rows_key,
+    _sequential_null,
+    _sphere,
+    quantile_test,
+)
+
+_QUERY_SIZE = 2**20  # maximum number of rotated coordinates per KDTree query
+_SPIN_BYTES = 48  # bytes per vertex and permutation generating spins: rotated coordinates, query results and spins
+_TREE_BYTES = 64  # bytes per vertex of the KD-trees of the sphere and their copies of the coordinates
+_WORKER_QUERIES = 2**22  # minimum number of rotated coordinates queried per process, outweighing its startup
+
+
+def _seed_sequence(seed):
+    """`numpy.random.SeedSequence` from an int seed, or with entropy drawn from a RandomState (global if None)"""
+    if isinstance(seed, numbers.Integral):
+        return np.random.SeedSequence(int(seed))
+    return np.random.SeedSequence(check_random_state(seed).randint(2**32, size=4, dtype=np.uint64))
+
+
+def _permutation_seeds(sequence, start, stop):
+    """seeds of permutations `start, ..., stop - 1`, the children `sequence.spawn(stop)[start:]` of a fresh
+    `sequence`, derived without spawning (which advances `sequence`) or creating the first `start` children"""
+    return [
+        np.random.SeedSequence(sequence.entropy, spawn_key=sequence.spawn_key + (i,), pool_size=sequence.pool_size)
+        for i in range(start, stop)
+    ]
+
+
+def _random_rotation(rng):
+    """random rotation matrix, uniformly distributed over SO(3)"""
+    rot_l, temp = np.linalg.qr(rng.normal(size=(3, 3)))
+    rot_l = rot_l @ np.diag(np.sign(np.diag(temp)))
+    if np.linalg.det(rot_l) < 0:
+        rot_l[:, 0] = -rot_l[:, 0]
+    return rot_l
+
+
+def _spin_block(coords, hemiid, seeds, out, start, workers=1):
+    """write spins for permutations `start, ..., start + len(seeds) - 1` into columns of `out`"""
+    reflect = np.array([[-1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    inds = np.arange(len(coords), dtype=np.int32)
+    rots = [_random_rotation(np.random.default_rng(seed)) for seed in seeds]
+
+    for h in range(2):
+        mask = hemiid == h
+        coor, hemi_inds = coords[mask], inds[mask]
+        if len(coor) == 0:
+            continue
+        hemi_rots = rots if h == 0 else [reflect @ rot_l @ reflect for rot_l in rots]
+
+        # one tree on the unrotated sphere, queried with inversely rotated coordinates:
+        # |coor_j @ rot - coor_i| == |coor_j - coor_i @ rot.T|, so neighbors match a tree built on `coor @ rot`
+        tree = spatial.cKDTree(coor)
+        n_batch = max(1, _QUERY_SIZE // len(coor))  # rotations stacked into one query
+        for i in range(0, len(seeds), n_batch):
+            j = min(i + n_batch, len(seeds))
+            queries = np.concatenate([coor @ rot.T for rot in hemi_rots[i:j]])
+            _, col = tree.query(queries, k=1, workers=workers)
+            out[mask, start + i : start + j] = hemi_inds[col.reshape(j - i, len(coor)).T]
+
+
+def _shared_dir(nbytes):
+    """directory of temporary spins shared between processes: shared memory (`/dev/shm`) if it holds `nbytes`, or
+    else the temporary directory"""
+    if os.path.isdir("/dev/shm") and shutil.disk_usage("/dev/shm").free > nbytes:
+        return "/dev/shm"
+    return None
+
+
+class _SpinBuffer:
+    """spins of the first `n` permutations of a fit, in the leading columns of one array preallocated for `capacity`
+    permutations and extended in place by each batch: a new cache entry if `cache` is given as `(cache_dir, name)`,
+    a file in shared memory if spun by several processes, or else an array in memory"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.array, self.cache, self.n = None, None, 0
+        self.stored = None
+
+    def allocate(self, n_vertices, cache=None, shared=False):
+        # column-major, so the spins of the first permutations are one contiguous block
+        shape = (n_vertices, self.capacity)
+        if cache is not None:
+            self.array = create_array(cache[0], shape, np.int32)
+        elif shared:
+            self.array = create_array(_shared_dir(4 * n_vertices * self.capacity), shape, np.int32)
+        else:
+            self.array = np.empty(shape, dtype=np.int32, order="F")
+        self.cache = cache
+
+    @property
+    def spins(self):
+        return None if self.n == 0 else self.array[:, : self.n]
+
+    def store(self):
+        """store the spins in the cache once, as one entry replacing the entries of fewer permutations, and return
+        them memory-mapped"""
+        if self.stored is None:
+            cache_dir, name = self.cache
+            with stage("cache"):
+                if self.n == self.capacity:
+                    self.stored = publish_array(self.array, cache_dir, name, self.n)
+                else:  # stopped early
+                    self.stored = save_array(cache_dir, name, self.n, self.spins)
+                for key in list_keys(cache_dir, name):
+                    if key.isdigit() and int(key) < self.n:
+                        remove_array(cache_dir, name, key)
+        return self.stored
 
 
 class PermutationResampler(BaseEstimator):
@@ -18,20 +145,43 @@ class PermutationResampler(BaseEstimator):
     alpha : float, optional
         significance level for the quantile test, by default 0.05
     reuse_spins : bool, optional
-        reuse spins across sequential calls to `fit`, by default True
+        reuse spins across sequential calls to `fit`, by default True; if False (and without `cache_dir`), spins
+        are generated one chunk at a time and dropped once scored, so memory scales with the chunk size rather than
+        `n_permutations`
     n_jobs : int, optional
-        number of workers used by KDTree queries (`-1` uses all cores), by default -1
+        number of processes generating blocks of spins, each of at least a few million rotated coordinates, or of
+        KDTree query workers if only one process is used (`-1` uses all cores), by default -1
+    chunk_size : int, optional
+        number of permutations scored per chunk, overrides `max_memory` if set, by default None
+    max_memory : float, optional
+        memory budget in megabytes for each chunk of permuted maps (`None` scores all at once), by default 1024
+    cache_dir : str or pathlib.Path, optional
+        directory of spins persisted across processes and memory-mapped on load, stored as one entry per fit
+        (extending, and replacing, the entry of an earlier fit with fewer permutations), used only if `seed` is an
+        int, by default None
+    batch_size : int, optional
+        if set, spin and score permutations in batches of this size, stopping before `n_permutations` once `null_`
+        is settled for every pair of maps, by default None
+    callback : callable, optional
+        called as `callback(n_done, n_permutations)` after each chunk of permutations is scored, e.g. to report
+        progress or to stop a run by raising an exception, by default None
     seed : None, int or instance of RandomState, optional
         seed for the random state generator, by default None
 
     Attributes
     ----------
-    param_ : float
+    param_ : float or ndarray of shape (n_X, n_Y)
         map-to-map correlation across both hemispheres combined
-    params_ : ndarray of shape (n_permutations,)
+    params_ : ndarray of shape ([n_X, n_Y,] n_draws_)
         rotated map-to-map correlations across both hemispheres combined
-    null_ : bool
+    null_ : bool or ndarray of shape (n_X, n_Y)
         True if `param_` falls inside the central quantile interval
+    n_draws_ : int
+        number of permutations used, less than `n_permutations` if stopped early
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last fit: loading
+        the sphere ("sphere"), rotating it and querying KD-trees ("spins"), reading or writing the spin cache
+        ("cache") and correlating rotated maps ("correlation")
 
     References
     ----------
@@ -39,13 +189,30 @@ class PermutationResampler(BaseEstimator):
        spatial correspondence between maps of human brain structure and function.  NeuroImage (2018)
     """
 
-    def __init__(self, n_permutations=1000, alpha=0.05, reuse_spins=True, seed=None, n_jobs=-1):
+    def __init__(
+        self,
+        n_permutations=1000,
+        alpha=0.05,
+        reuse_spins=True,
+        seed=None,
+        n_jobs=-1,
+        chunk_size=None,
+        max_memory=1024,
+        cache_dir=None,
+        batch_size=None,
+        callback=None,
+    ):
         super().__init__()
         self.n_permutations = n_permutations
         self.alpha = alpha
         self.reuse_spins = reuse_spins
         self.seed = seed
         self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.max_memory = max_memory
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.callback = callback
 
     def _corr(self, X_data, Y_data):
         xm = X_data - X_data.mean()
@@ -53,44 +220,160 @@ class PermutationResampler(BaseEstimator):
         den = np.linalg.norm(xm) * np.linalg.norm(ym)
         return (xm @ ym) / den
 
-    def _gen_spinsamples(self, coords, hemiid):
-        """rewrite of `neuromaps.nulls.spins.gen_spinsamples` with parellel processing"""
+    def _n_workers(self, n_permutations, n_vertices):
+        """number of processes generating spins of `n_permutations`, each spinning a minimum number of permutations
+        (of `_WORKER_QUERIES` coordinates), below which they are spun in this process by KDTree query workers"""
+        min_permutations = max(1, _WORKER_QUERIES // n_vertices)
+        return max(1, min(effective_n_jobs(self.n_jobs), n_permutations // min_permutations))
+
+    def _gen_spinsamples(self, coords, hemiid, start=0, stop=None, sequence=None, out=None):
+        """rewrite of `neuromaps.nulls.spins.gen_spinsamples` with parellel processing, for permutations
+        `start, ..., stop - 1` seeded from `sequence` (by default from `seed`), written into columns
+        `start, ..., stop - 1` of `out` if given"""
 
         if coords.shape[-1] != 3 or coords.squeeze().ndim != 2 or hemiid.ndim != 1 or len(coords) != len(hemiid):
             raise ValueError("Expected coords shape (N, 3) and hemiid shape (N,)")
 
-        rng = check_random_state(self.seed)
-        reflect = np.array([[-1, 0, 0], [0, 1, 0], [0, 0, 1]])
-        inds = np.arange(len(coords), dtype=np.int32)
-        masks = [hemiid == 0, hemiid == 1]
-        hemi_coords = [coords[m] for m in masks]
-        hemi_inds = [inds[m] for m in masks]
-        spinsamples = np.empty((len(coords), self.n_permutations), dtype=np.int32)
-
-        for n in range(self.n_permutations):
-            rot_l, temp = np.linalg.qr(rng.normal(size=(3, 3)))
-            rot_l = rot_l @ np.diag(np.sign(np.diag(temp)))
-            if np.linalg.det(rot_l) < 0:
-                rot_l[:, 0] = -rot_l[:, 0]
-
-            resampled = np.empty(len(coords), dtype=np.int32)
-            for h, rot in enumerate((rot_l, reflect @ rot_l @ reflect)):
-                coor = hemi_coords[h]
-                if len(coor) == 0:
-                    continue
-                _, col = spatial.cKDTree(coor @ rot, balanced_tree=False).query(coor, k=1, workers=self.n_jobs)
-                resampled[masks[h]] = hemi_inds[h][col]
-
-            spinsamples[:, n] = resampled
-
-        return spinsamples
-
-    def _spin_vertices(self, X):
-        n_vertices = X.shape[0] // 2
-        spheres = fetch_atlas(X.atlas, X.density)["sphere"]
-        coords, hemi = get_parcel_centroids(spheres, parcellation=None, method="surface")
-        spins_arr = self._gen_spinsamples(coords, hemi)
-        return {"left": spins_arr[:n_vertices], "right": spins_arr[n_vertices:] - n_vertices}
+        # one independent random stream per permutation, so spins do not depend on the number of processes or
+        # on how permutations are split into batches
+        stop = self.n_permutations if stop is None else stop
+        sequence = _seed_sequence(self.seed) if sequence is None else sequence
+        seeds = _permutation_seeds(sequence, start, stop)
+        n_permutations = len(seeds)
+        offset = 0 if out is None else start
+        n_workers = self._n_workers(n_permutations, len(coords))
+        if out is not None and not isinstance(out, np.memmap):
+            n_workers = 1  # written in place in the memory of this process
+        if n_workers == 1:
+            spinsamples = np.empty((len(coords), n_permutations), dtype=np.int32) if out is None else out
+            _spin_block(coords, hemiid, seeds, spinsamples, offset, workers=self.n_jobs)
+            return spinsamples
+
+        # blocks of permutations are written by each process straight into one shared memory-mapped array: `out`
+        # (e.g. a cache entry), or else a file in shared memory removed once unmapped
+        if out is None:
+            nbytes = 4 * len(coords) * n_permutations
+            out = create_array(_shared_dir(nbytes), (len(coords), n_permutations), np.int32)
+        bounds = np.linspace(0, n_permutations, n_workers + 1).astype(int)
+        Parallel(n_jobs=n_workers)(
+            delayed(_spin_block)(coords, hemiid, seeds[i:j], out, offset + i, workers=1)
+            for i, j in zip(bounds[:-1], bounds[1:])
+        )
+        return out
+
+    def _cache_name(self, X, coords, hemi):
+        """name of the persistent spins, content-addressed by atlas, sphere coordinates and seed (None if spins
+        are not cached)"""
+        if self.cache_dir is None or not isinstance(self.seed, numbers.Integral):
+            return None
+        return "spins-" + cache_key(
+            atlas=X.atlas, density=X.density, coords=hash_arrays(coords, hemi), seed=int(self.seed), rng="seed-sequence"
+        )
+
+    def _spin_vertices(self, X, n_permutations=None, spins=None, buffer=None):
+        """spins of shape (n_vertices, n_permutations) indexing both hemispheres combined, extending `spins` of the
+        first permutations if given, in place in the leading columns of `buffer` (by default a new `_SpinBuffer` of
+        `n_permutations`)"""
+        n_permutations = self.n_permutations if n_permutations is None else n_permutations
+        buffer = _SpinBuffer(n_permutations) if buffer is None else buffer
+        with stage("sphere"):
+            coords, hemi = _sphere(X)
+        name = self._cache_name(X, coords, hemi)
+        if name is not None and buffer.n == 0:
+            # stored as one entry per fit, keyed by its number of permutations: the first permutations are read
+            # from the largest entry, and only the missing ones are generated
+            with stage("cache"):
+                keys = sorted(int(key) for key in list_keys(self.cache_dir, name) if key.isdigit())
+                cached = None
+                for n in keys[::-1]:
+                    cached = load_array(self.cache_dir, name, n)
+                    if cached is not None:  # else removed since listed
+                        break
+            if cached is not None and cached.shape[1] >= n_permutations:
+                return cached[:, :n_permutations]
+            if cached is not None and (spins is None or spins.shape[1] < cached.shape[1]):
+                spins = cached
+
+        if buffer.array is None:
+            cache = None if name is None else (self.cache_dir, name)
+            buffer.allocate(len(coords), cache, shared=self._n_workers(buffer.capacity, len(coords)) > 1)
+        if spins is not None and spins.shape[1] > buffer.n:
+            buffer.array[:, buffer.n : spins.shape[1]] = spins[:, buffer.n :]  # e.g. of an earlier fit, copied once
+            buffer.n = spins.shape[1]
+        if buffer.n < n_permutations:
+            with stage("spins"):
+                self._gen_spinsamples(coords, hemi, buffer.n, n_permutations, out=buffer.array)
+            buffer.n = n_permutations
+        if buffer.cache is not None and buffer.n == buffer.capacity:
+            return buffer.store()
+        return buffer.spins
+
+    def _iter_spins(self, coords, hemi, start, stop, block_size, sequence):
+        """blocks of spins of shape (n_vertices, block_size) of permutations `start, ..., stop - 1`, generated
+        lazily from one seed per permutation of `sequence`, so they do not depend on `block_size`"""
+        for i in range(start, stop, block_size):
+            with stage("spins"):
+                spins = self._gen_spinsamples(coords, hemi, i, min(i + block_size, stop), sequence)
+            yield spins
+
+    def _get_spins(self, X, n_permutations=None, buffer=None):
+        """spins of the first `n_permutations`, reused (or extended) across sequential calls to `fit`, or else
+        extending the spins of earlier batches of the same fit, in place in `buffer`"""
+        n_permutations = self.n_permutations if n_permutations is None else n_permutations
+        key = _rows_key(X)  # spins of other rows (e.g. another atlas or medial wall mask) are regenerated
+        reuse = self.reuse_spins and hasattr(self, "_spins") and self._spins_key == key
+        stored = self._spins if reuse else None if buffer is None else buffer.spins
+        if stored is not None and stored.shape[1] >= n_permutations:
+            return stored[:, :n_permutations]
+        spins = self._spin_vertices(X, n_permutations, stored, buffer)
+        if self.reuse_spins:
+            self._spins, self._spins_key = spins, key
+        return spins
+
+    def _score(self, X, X_n, Y_n, param_):
+        """rotated map-to-map correlations, scored in chunks of permutations and in batches if sequential"""
+        stream = not self.reuse_spins and self.cache_dir is None
+        # float64 gathered maps per column, centered in place, and if streamed the spins of the column with the
+        # rotated coordinates and query results of their generation, and the KD-trees of the sphere
+        bytes_per_column = 8 * X_n.size + (_SPIN_BYTES * len(X_n) if stream else 0)
+        fixed_bytes = _corr_bytes(X_n, Y_n, self.n_permutations) + (_TREE_BYTES * len(X_n) if stream else 0)
+        chunk_size = _get_chunk_size(
+            bytes_per_column, self.n_permutations, self.chunk_size, self.max_memory, fixed_bytes
+        )
+        if stream:
+            sequence = _seed_sequence(self.seed)  # shared by all batches of streamed spins
+            with stage("sphere"):
+                coords, hemi = _sphere(X)
+        # spins of all batches of this fit, preallocated once and extended in place by each batch
+        buffer = _SpinBuffer(self.n_permutations)
+
+        def score(start, stop):
+            if not stream:
+                spins = self._get_spins(X, stop, buffer)[:, start:stop]
+
+                # each rotated X is gathered once and correlated with all of Y in one matrix product
+                def gather(cols):
+                    return X_n[spins[:, cols]]
+
+            else:
+                # spins streamed in blocks of one chunk, in the order chunks are scored, and dropped once scored
+                blocks = self._iter_spins(coords, hemi, start, stop, chunk_size, sequence)
+
+                def gather(cols):
+                    return X_n[next(blocks)]
+
+            def progress(n_done):
+                self.callback(start + n_done, self.n_permutations)
+
+            with stage("correlation"):
+                return _chunked_corr(gather, Y_n, stop - start, chunk_size, None if self.callback is None else progress)
+
+        params_ = _sequential_null(score, param_, self.n_permutations, self.batch_size, self.alpha)
+        if buffer.cache is not None and buffer.stored is None:  # stopped early, stored as one entry
+            spins = buffer.store()
+            if self.reuse_spins:
+                self._spins = spins
+        return params_
 
     def fit(self, X, Y):
         """Fit PermutationResampler.
@@ -107,29 +390,55 @@ class PermutationResampler(BaseEstimator):
             raise ValueError(f"X and Y must have the same shape. X: {X.shape}, Y: {Y.shape}")
 
         # combine hemispheres
-        X_n = np.concatenate([X.data.parts["left"], X.data.parts["right"]])
-        Y_n = np.concatenate([Y.data.parts["left"], Y.data.parts["right"]])
+        X_n = _combine(X)
+        Y_n = _combine(Y)
 
         # full-map correlation across hemispheres
         rho_n_ = self._corr(X_n, Y_n)
 
-        # permute patch correlation across hemispheres
-        if self.reuse_spins and hasattr(self, "_spins") and self._spins["left"].shape[1] == self.n_permutations:
-            spins = self._spins
-        else:
-            spins = self._spin_vertices(X)
-            if self.reuse_spins:
-                self._spins = spins
+        # rotated map-to-map correlations, timed per stage
+        with profile() as timings:
+            params_ = self._score(X, X_n, Y_n, rho_n_)
+
+        self.is_fitted_ = True
+        self.param_ = rho_n_
+        self.params_ = params_
+        self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.n_draws_ = params_.shape[-1]
+        self.timings_ = timings
+        return self
+
+    def fit_many(self, X, Y):
+        """Fit PermutationResampler on every pair of maps from two stacks, sharing one set of spins.
+
+        Parameters
+        ----------
+        X : Surface
+            surface object containing `n_X` maps as data of shape (n_vertices, n_X) for both hemispheres
+        Y : Surface
+            surface object containing `n_Y` maps as data of shape (n_vertices, n_Y) for both hemispheres
+        """
+        # check X, Y are same surface
+        if X.shape[0] != Y.shape[0]:
+            raise ValueError(f"X and Y must have the same number of vertices. X: {X.shape}, Y: {Y.shape}")
+
+        # combine hemispheres, as stacks of maps
+        X_n = _combine(X)
+        X_n = X_n.reshape(len(X_n), -1)
+        Y_n = _combine(Y)
+        Y_n = Y_n.reshape(len(Y_n), -1)
+
+        # full-map correlations across hemispheres
+        rho_n_ = _pairwise_corr(X_n, Y_n)
 
-        # permute patch correlation across hemispheres
-        params_ = np.zeros(self.n_permutations)
-        n_vertices = X.shape[0] // 2
-        for permutation in range(self.n_permutations):
-            idx = np.concatenate([spins["left"][:, permutation], spins["right"][:, permutation] + n_vertices])
-            params_[permutation] = self._corr(X_n[idx], Y_n)
+        # rotated map-to-map correlations, for all pairs of maps at once, timed per stage
+        with profile() as timings:
+            params_ = self._score(X, X_n, Y_n, rho_n_)
 
         self.is_fitted_ = True
         self.param_ = rho_n_
         self.params_ = params_
         self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.n_draws_ = params_.shape[-1]
+        self.timings_ = timings
         return self
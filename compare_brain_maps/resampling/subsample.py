@@ -1,8 +1,21 @@
 import numpy as np
+from scipy import sparse
 from sklearn.base import BaseEstimator
 from sklearn.utils import check_random_state
 
-from ._base import quantile_test
+from ..utils._graph import ball_search, edge_lengths
+from ..utils._profile import profile, stage
+from ._base import (
+    _callback_chunks,
+    _combine,
+    _graph,
+    _pairwise_corr,
+    _rows_key,
+    _sequential_null,
+    _stat_maps,
+    _weighted_corr,
+    quantile_test,
+)
 
 
 class SubsampleResampler(BaseEstimator):
@@ -14,29 +27,56 @@ class SubsampleResampler(BaseEstimator):
         number of subsamples, by default 1000
     patch_size : int, optional
         number of iterations to grow the patch, by default 4
+    patch_radius : float, optional
+        geodesic radius of the patch along mesh edges, overrides `patch_size` if set, by default None
     alpha : float, optional
         significance level for the quantile test, by default 0.05
     reuse_patches : bool, optional
         reuse patches across sequantial calls to `fit`, by default True
+    batch_size : int, optional
+        if set, grow and score patches in batches of this size, stopping before `n_subsamples` once `null_` is
+        settled for every pair of maps, by default None
+    callback : callable, optional
+        called as `callback(n_done, n_subsamples)` after each chunk of at most 100 subsamples is scored (split at the
+        end of each batch if `batch_size` is set), e.g. to report progress or to stop a run by raising an exception,
+        by default None
     seed : None, int or instance of RandomState, optional
         seed for the random state generator, by default None
 
     Attributes
     ----------
-    param_ : float
+    param_ : float or ndarray of shape (n_X, n_Y)
         map-to-map correlation across both hemispheres combined
-    params_ : ndarray of shape (n_subsamples,)
+    params_ : ndarray of shape ([n_X, n_Y,] n_draws_)
         patch-to-patch correlations across both hemispheres combined
-    null_ : bool
+    null_ : bool or ndarray of shape (n_X, n_Y)
         True if `param_` falls inside the central quantile interval
+    n_draws_ : int
+        number of subsamples used, less than `n_subsamples` if stopped early
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last fit: building
+        the adjacency matrices ("adjacency"), growing patches ("patches") and correlating patches ("correlation")
     """
 
-    def __init__(self, n_subsamples=1000, patch_size=4, alpha=0.05, reuse_patches=True, seed=None):
+    def __init__(
+        self,
+        n_subsamples=1000,
+        patch_size=4,
+        patch_radius=None,
+        alpha=0.05,
+        reuse_patches=True,
+        batch_size=None,
+        callback=None,
+        seed=None,
+    ):
         super().__init__()
         self.n_subsamples = n_subsamples
         self.patch_size = patch_size
+        self.patch_radius = patch_radius
         self.alpha = alpha
         self.reuse_patches = reuse_patches
+        self.batch_size = batch_size
+        self.callback = callback
         self.seed = seed
 
     def _corr(self, X_data, Y_data):
@@ -45,60 +85,130 @@ class SubsampleResampler(BaseEstimator):
         den = np.linalg.norm(xm) * np.linalg.norm(ym)
         return (xm @ ym) / den
 
-    def _subsample_vertices(self, A, rng):
+    def _subsample_vertices(self, A, u, coords=None):
+        """sparse membership matrix of shape (n_patches, n_vertices) of patches grown from seed vertices at uniform
+        positions `u` in [0, 1) of the vertex order"""
         n_vertices = A.shape[0]
-        patches = np.zeros((n_vertices, self.n_subsamples), dtype=bool)
-        patches[rng.randint(0, n_vertices, size=self.n_subsamples), np.arange(self.n_subsamples)] = True
-        for _ in range(self.patch_size):
-            patches = (A @ patches) > 0
+        seeds = (u * n_vertices).astype(np.int64)
+        if self.patch_radius is None:
+            rows, cols, _ = ball_search(A, seeds, self.patch_size)
+        else:
+            rows, cols, _ = ball_search(edge_lengths(A, coords), seeds, self.patch_radius, weighted=True)
+        return sparse.csr_array((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(len(seeds), n_vertices))
+
+    def _get_patches(self, X, n_subsamples=None, grown=None):
+        """patches of the first `n_subsamples`, reused (or extended) across sequential calls to `fit`, or else
+        extending the patches `grown` by earlier batches of the same fit"""
+        n_subsamples = self.n_subsamples if n_subsamples is None else n_subsamples
+        key = _rows_key(X)  # patches of other rows (e.g. another atlas or medial wall mask) are regrown
+        reuse = self.reuse_patches and hasattr(self, "_patches") and self._patches_key == key
+        stored = self._patches if reuse else grown
+        if stored is not None and stored.shape[0] >= n_subsamples:
+            return stored[:n_subsamples]
+        start = 0 if stored is None else stored.shape[0]
+
+        # seeds of each subsample are drawn as one (left, right) pair (one seed for a volume), so the first patches do
+        # not depend on the number of subsamples and only new patches are grown when extending
+        with stage("adjacency"):
+            A, coords = _graph(X)  # X = Y, of the cortical vertices, the voxels or the parcels
+        rng = check_random_state(self.seed)
+        u = rng.random_sample(size=(n_subsamples, len(A)))[start:]
+        with stage("patches"):
+            # one patch per hemisphere (or part of a volume) of each subsample, combined
+            patches = [self._subsample_vertices(A[part], u[:, i], coords[part]) for i, part in enumerate(A)]
+            patches = sparse.hstack(patches, format="csr")
+            if stored is not None:
+                patches = sparse.vstack([stored, patches], format="csr")
+        if self.reuse_patches:
+            self._patches, self._patches_key = patches, key
         return patches
 
+    def _score(self, X, X_n, Y_n, param_):
+        """normalized patch-to-patch correlations for all pairs of maps, in batches of patches if sequential, and in
+        chunks of patches between calls to the callback"""
+        n = X_n.shape[0]
+        grown = None  # patches grown by earlier batches, kept within this fit even if not reused across fits
+        with stage("correlation"):
+            maps = _stat_maps(X_n, Y_n)  # standardized once, so chunks of patches only weight them
+
+        def score(start, stop):
+            nonlocal grown
+            patches = grown = self._get_patches(X, stop, grown)
+            params_ = []
+            for chunk in _callback_chunks(start, stop, self.callback):
+                with stage("correlation"):
+                    rho_m_, m = _weighted_corr(patches[chunk], X_n, Y_n, maps)
+                params_.append(np.sqrt(m / n) * (rho_m_ - np.expand_dims(param_, -1)))
+                if self.callback is not None:
+                    self.callback(chunk.stop, self.n_subsamples)
+            return np.concatenate(params_, axis=-1)
+
+        return _sequential_null(score, param_, self.n_subsamples, self.batch_size, self.alpha)
+
     def fit(self, X, Y):
         """Fit SubsampleResampler.
 
         Parameters
         ----------
-        X : Surface
-            surface object containing the data and mesh for both hemispheres
-        Y : Surface
-            surface object containing the data and mesh for both hemispheres
+        X : Surface or Volume
+            surface object containing the data and mesh for both hemispheres, or volume object
+        Y : Surface or Volume
+            surface object containing the data and mesh for both hemispheres, or volume object
         """
         # check X, Y are same surface
         if X.shape != Y.shape:
             raise ValueError(f"X and Y must have the same shape. X: {X.shape}, Y: {Y.shape}")
 
         # combine hemispheres
-        X_n = np.concatenate([X.data.parts["left"], X.data.parts["right"]])
-        Y_n = np.concatenate([Y.data.parts["left"], Y.data.parts["right"]])
-        n = X_n.shape[0]
+        X_n = _combine(X)
+        Y_n = _combine(Y)
 
         # full-map correlation across hemispheres
         rho_n_ = self._corr(X_n, Y_n)
 
-        # subsample patch correlations across hemispheres
-        if self.reuse_patches and hasattr(self, "_patches") and self._patches["left"].shape[1] == self.n_subsamples:
-            patches = self._patches
-        else:
-            A = X.get_adjacency()  # X = Y
-            rng = check_random_state(self.seed)
-            patches = {
-                "left": self._subsample_vertices(A["left"], rng),
-                "right": self._subsample_vertices(A["right"], rng),
-            }
-            if self.reuse_patches:
-                self._patches = patches
-
-        params_ = np.zeros(self.n_subsamples)
-        for subsample in range(self.n_subsamples):
-            patch_left = patches["left"][:, subsample]
-            patch_right = patches["right"][:, subsample]
-            patch = np.concatenate([patch_left, patch_right]).astype(bool)
-            m = patch.sum()
-            rho_m_ = self._corr(X_n[patch], Y_n[patch])
-            params_[subsample] = np.sqrt(m / n) * (rho_m_ - rho_n_)
+        # subsample patch correlations across hemispheres, timed per stage
+        with profile() as timings:
+            params_ = self._score(X, X_n[:, None], Y_n[:, None], np.reshape(rho_n_, (1, 1)))[0, 0]
+
+        self.param_ = rho_n_
+        self.params_ = params_
+        self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.n_draws_ = params_.shape[-1]
+        self.timings_ = timings
+
+        return self
+
+    def fit_many(self, X, Y):
+        """Fit SubsampleResampler on every pair of maps from two stacks, sharing one set of patches.
+
+        Parameters
+        ----------
+        X : Surface or Volume
+            surface (or volume) object containing `n_X` maps as data of shape (n_vertices, n_X)
+        Y : Surface or Volume
+            surface (or volume) object containing `n_Y` maps as data of shape (n_vertices, n_Y)
+        """
+        # check X, Y are same surface
+        if X.shape[0] != Y.shape[0]:
+            raise ValueError(f"X and Y must have the same number of vertices. X: {X.shape}, Y: {Y.shape}")
+
+        # combine hemispheres, as stacks of maps
+        X_n = _combine(X)
+        X_n = X_n.reshape(len(X_n), -1)
+        Y_n = _combine(Y)
+        Y_n = Y_n.reshape(len(Y_n), -1)
+
+        # full-map correlations across hemispheres
+        rho_n_ = _pairwise_corr(X_n, Y_n)
+
+        # subsample patch correlations across hemispheres, for all pairs of maps at once, timed per stage
+        with profile() as timings:
+            params_ = self._score(X, X_n, Y_n, rho_n_)
 
         self.param_ = rho_n_
         self.params_ = params_
         self.null_ = quantile_test(self.param_, self.params_, alpha=self.alpha)
+        self.n_draws_ = params_.shape[-1]
+        self.timings_ = timings
 
         return self
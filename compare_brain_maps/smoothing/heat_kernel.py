@@ -1,9 +1,43 @@
-import copy
-
 import numpy as np
 from lapy import Solver, TriaMesh
+from scipy import sparse
+from scipy.special import ive
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.utils import check_random_state
+
+from ..utils._eigen import load_mesh_eigenpairs
+from ..utils._profile import profile, stage
+
+
+def _chebyshev_heat(stiffness, mass, data, sigmas, tol):
+    """apply the heat kernel exp(-sigma L), with L = diag(mass)^-1 stiffness, to `data` for every sigma.
+
+    The kernel is expanded in Chebyshev polynomials of L on its spectral interval [0, lambda_max], whose
+    coefficients are exponentially scaled modified Bessel functions, and the expansion is truncated once they
+    fall below `tol`. The Chebyshev vectors are shared across sigmas, and each term costs one sparse product.
+
+    Returns
+    -------
+    ndarray of shape (n_vertices, n_sigmas * n_maps)
+        smoothed data, with columns grouped by sigma
+    """
+    L = sparse.csr_array(sparse.diags_array(1 / mass) @ stiffness)
+    lambda_max = np.max(abs(L).sum(axis=1))  # gershgorin bound on the spectrum of L
+    a = sigmas * lambda_max / 2
+    n_terms = 1
+    while 2 * ive(n_terms, a.max()) > tol:
+        n_terms += 1
+
+    # exclude the constant mode, as in the eigenmode expansion
+    X = data.reshape(data.shape[0], -1)
+    X = X - (mass @ X) / mass.sum()
+
+    # T_{k+1}(M) X = 2 M T_k(M) X - T_{k-1}(M) X, with M = 2 L / lambda_max - I mapping the spectrum to [-1, 1]
+    T_prev, T = X, (2 / lambda_max) * (L @ X) - X
+    smoothed = ive(0, a)[:, None, None] * T_prev + (-2 * ive(1, a))[:, None, None] * T
+    for k in range(2, n_terms + 1):
+        T_prev, T = T, 2 * ((2 / lambda_max) * (L @ T) - T) - T_prev
+        smoothed += (2 * (-1) ** k * ive(k, a))[:, None, None] * T
+    return np.moveaxis(smoothed, 0, 1).reshape(X.shape[0], -1)
 
 
 class HeatKernelSmoother(TransformerMixin, BaseEstimator):
@@ -11,25 +45,45 @@ class HeatKernelSmoother(TransformerMixin, BaseEstimator):
 
     Parameters
     ----------
-    sigma : float, optional
+    sigma : float or array-like of shape (n_sigmas,), optional
         smoothing parameter controlling the width of the heat kernel, by default 1.0
     n_modes : int, optional
         number of eigenmodes, by default 500
+    method : str, optional
+        "eigen" for the truncated eigenmode expansion, or "chebyshev" to apply the heat kernel to the data with a
+        Chebyshev polynomial expansion on the lumped-mass FEM matrices, without eigendecomposition,
+        by default "eigen"
+    tol : float, optional
+        truncation tolerance of the Chebyshev expansion, by default 1e-6
     reuse_eigenpairs : bool, optional
         reuse eigenpairs of mesh across sequential calls to `transform`, by default True
+    cache_dir : str or pathlib.Path, optional
+        directory of eigenpairs persisted across processes and memory-mapped on load, by default None
     seed : None, int or instance of RandomState, optional
         seed for the random state generator, by default None
 
+    Attributes
+    ----------
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last `transform`:
+        computing or loading eigenpairs ("eigenpairs") or assembling the FEM matrices ("operator"), and smoothing
+        ("smoothing")
+
     References
     ----------
     .. [1] Seo, Chung, Vorperian, Jiang, Navab, Pluim, Viergever.  Heat Kernel Smoothing Using
         Laplace-Beltrami Eigenfunctions. Medical Image Computing and Computer-Assisted Intervention (2010)
     """
 
-    def __init__(self, sigma=1.0, n_modes=500, reuse_eigenpairs=True, seed=None):
+    def __init__(
+        self, sigma=1.0, n_modes=500, method="eigen", tol=1e-6, reuse_eigenpairs=True, cache_dir=None, seed=None
+    ):
         self.sigma = sigma
         self.n_modes = n_modes
+        self.method = method
+        self.tol = tol
         self.reuse_eigenpairs = reuse_eigenpairs
+        self.cache_dir = cache_dir
         self.seed = seed
 
     def fit(self, X):
@@ -42,35 +96,60 @@ class HeatKernelSmoother(TransformerMixin, BaseEstimator):
         Parameters
         ----------
         X : Surface
-            surface object containing the data and mesh for both hemispheres
+            surface object containing the data of shape (n_vertices,) or (n_vertices, n_maps) and mesh for both
+            hemispheres
 
         Returns
         -------
         Surface
-            surface object with data smoothed on the surface mesh
+            surface object with data smoothed on the surface mesh, of the same shape as `X.data` if `sigma` is a
+            scalar, otherwise of shape (n_vertices, n_sigmas * n_maps) with columns grouped by sigma
         """
-        X_smoothed = copy.deepcopy(X)
+        if self.method not in ("eigen", "chebyshev"):
+            raise ValueError(f"method must be one of 'eigen', 'chebyshev', got {self.method}")
+
+        # smoothing on the cortex mesh if the medial wall is masked, which is NaN in the smoothed data
+        _, _, mesh = X.get_cortex()
+        with profile() as timings:
+            smoothed_data = self._smooth(mesh, X.compress())
+        self.timings_ = timings
+        return X.expand(smoothed_data)
 
-        # compute laplace-beltrami eigenpairs, or load precomputed
-        if self.reuse_eigenpairs and hasattr(self, "_eigenpairs"):
-            eigenpairs = self._eigenpairs
-        else:
-            eigenpairs = {}
+    def _smooth(self, mesh, X_data):
+        """smoothed data per hemisphere"""
+        smoothed_data = {}
+        sigmas = np.atleast_1d(self.sigma)
+
+        if self.method == "chebyshev":
             for hemi in ["left", "right"]:
-                mesh = X_smoothed.mesh.parts[hemi]
-                tria_mesh = TriaMesh(v=mesh.coordinates, t=mesh.faces)
-                fem = Solver(geometry=tria_mesh, use_cholmod=True)  # requires scikit-sparse
-                rng = check_random_state(self.seed)
-                evals, emodes = fem.eigs(k=self.n_modes + 1, rng=rng)
-                evals, emodes = evals[1:], emodes[:, 1:]  # first is constant
-                eigenpairs[hemi] = (evals, emodes)
-            if self.reuse_eigenpairs:
-                self._eigenpairs = eigenpairs
-
-        # apply smoothing using eigenpairs
+                hemi_mesh = mesh.parts[hemi]
+                with stage("operator"):
+                    fem = Solver(geometry=TriaMesh(v=hemi_mesh.coordinates, t=hemi_mesh.faces), lump=True)
+                data = X_data[hemi]
+                with stage("smoothing"):
+                    smoothed = _chebyshev_heat(fem.stiffness, fem.mass.diagonal(), data, sigmas, self.tol)
+                smoothed_data[hemi] = smoothed.reshape(data.shape) if np.ndim(self.sigma) == 0 else smoothed
+            return smoothed_data
+
+        # compute laplace-beltrami eigenpairs, or load precomputed (slicing if more modes are stored)
+        reuse = self.reuse_eigenpairs and hasattr(self, "_eigenpairs")
+        stored = (self._eigenpairs_key, self._eigenpairs) if reuse else None
+        with stage("eigenpairs"):
+            key, eigenpairs = load_mesh_eigenpairs(mesh, self.n_modes, stored, self.cache_dir, self.seed)
+        if self.reuse_eigenpairs:
+            self._eigenpairs, self._eigenpairs_key = eigenpairs, key
+
+        # apply smoothing using eigenpairs, for all maps and sigmas in one matrix product
         for hemi in ["left", "right"]:
-            evals, emodes = eigenpairs[hemi]
-            beta_ = np.linalg.solve((emodes.T @ emodes), emodes.T @ X_smoothed.data.parts[hemi])
-            X_smoothed.data.parts[hemi] = np.sum(np.exp(-evals * self.sigma) * beta_ * emodes, axis=1)
+            evals, emodes, mass = eigenpairs[hemi]
+            evals, emodes = evals[: self.n_modes], emodes[:, : self.n_modes]
+            data = X_data[hemi]
+            with stage("smoothing"):
+                # eigenmodes are orthonormal in the inner product of the FEM mass matrix
+                beta_ = emodes.T @ (mass @ data.reshape(data.shape[0], -1))  # (n_modes, n_maps)
+                weights = np.exp(-np.outer(evals, sigmas))  # (n_modes, n_sigmas)
+                coeffs = (weights[:, :, None] * beta_[:, None, :]).reshape(len(evals), -1)
+                smoothed = emodes @ coeffs  # (n_vertices, n_sigmas * n_maps)
+            smoothed_data[hemi] = smoothed.reshape(data.shape) if np.ndim(self.sigma) == 0 else smoothed
 
-        return X_smoothed
+        return smoothed_data
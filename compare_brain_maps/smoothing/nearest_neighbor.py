@@ -1,7 +1,7 @@
-import copy
-
 from sklearn.base import BaseEstimator, TransformerMixin
 
+from ..utils._profile import profile, stage
+
 
 class NearestNeighborSmoother(TransformerMixin, BaseEstimator):
     """Iterative smoothing on a surface mesh by averaging over nearest neighbor vertices.
@@ -10,35 +10,56 @@ class NearestNeighborSmoother(TransformerMixin, BaseEstimator):
     ----------
     n_iterations : int, optional
         number of smoothing iterations, by default 1
+
+    Attributes
+    ----------
+    timings_ : dict
+        wall time in seconds ("time") and peak memory in bytes ("memory") of each stage of the last `fit` or
+        `transform`: building the propagation operator ("transition") and smoothing ("smoothing")
     """
 
     def __init__(self, n_iterations=1):
         self.n_iterations = n_iterations
 
     def fit(self, X):
-        """For scikit-learn compatibility."""
+        """Build the row-normalized adjacency (propagation operator) of the mesh, cached per mesh for `transform`.
+
+        Parameters
+        ----------
+        X : Surface or Volume
+            surface object containing the data and mesh for both hemispheres, or volume object
+        """
+        with profile() as timings, stage("transition"):
+            X.get_transition(compact=True)
+        self.timings_ = timings
         return self
 
     def transform(self, X):
-        """Apply nearest neighbor smoothing to `Surface.data`.
+        """Apply nearest neighbor smoothing to `Surface.data` or `Volume.data`.
 
         Parameters
         ----------
-        X : Surface
-            surface object containing the data and mesh for both hemispheres
+        X : Surface or Volume
+            surface (or volume) object containing the data of shape (n_vertices,) or (n_vertices, n_maps)
 
         Returns
         -------
-        Surface
-            surface object with data smoothed on the surface mesh
+        Surface or Volume
+            surface or volume object with data smoothed on its mesh or voxel grid
         """
-        X_smoothed = copy.deepcopy(X)
-        A = X_smoothed.get_adjacency()
+        # smoothing of the cortical vertices only if the medial wall is masked, which is NaN in the smoothed data
+        smoothed_data = {}
+        X_data = X.compress()
+        with profile() as timings:
+            with stage("transition"):
+                T = X.get_transition(compact=True)  # normalized adjacency matrix, cached per mesh
 
-        for hemi in ["left", "right"]:
-            # normalize adjacency matrix
-            A[hemi] = A[hemi] / A[hemi].sum(axis=0)
-            for _ in range(self.n_iterations):
-                X_smoothed.data.parts[hemi] = X_smoothed.data.parts[hemi] @ A[hemi]
+            for hemi, data in X_data.items():
+                with stage("smoothing"):
+                    smoothed = data.reshape(data.shape[0], -1)  # all maps propagated together
+                    for _ in range(self.n_iterations):
+                        smoothed = T[hemi] @ smoothed
+                smoothed_data[hemi] = smoothed.reshape(data.shape)
 
-        return X_smoothed
+        self.timings_ = timings
+        return X.expand(smoothed_data)
@@ -1,5 +1,6 @@
 """utility functions"""
 
 from .surface import Surface
+from .volume import Volume
 
-__all__ = ["Surface"]
+__all__ = ["Surface", "Volume"]
@@ -0,0 +1,97 @@
+"""content-addressed on-disk cache of numpy arrays"""
+
+import hashlib
+import json
+import os
+import tempfile
+import weakref
+from pathlib import Path
+
+import numpy as np
+
+
+def hash_arrays(*arrays):
+    """hash of the dtype, shape and contents of one or more arrays"""
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(f"{arr.dtype.str}{arr.shape}".encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def cache_key(**fields):
+    """content address of a cache entry from json-serializable fields"""
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_path(cache_dir, name, key):
+    return Path(cache_dir) / f"{name}-{key}.npy"
+
+
+def list_keys(cache_dir, name):
+    """keys of all arrays cached under `name`"""
+    return [path.stem[len(name) + 1 :] for path in Path(cache_dir).glob(f"{name}-*.npy")]
+
+
+def load_array(cache_dir, name, key):
+    """load a cached array as a read-only memory map, or return None if it does not exist"""
+    path = _cache_path(cache_dir, name, key)
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def save_array(cache_dir, name, key, arr):
+    """atomically write `arr` to the cache and return it as a read-only memory map.
+
+    The array is written to a temporary file in `cache_dir` and renamed into place, so concurrent
+    writers of the same entry never expose a partial file to readers.
+    """
+    path = _cache_path(cache_dir, name, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".npy", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return np.load(path, mmap_mode="r")
+
+
+def remove_array(cache_dir, name, key):
+    """remove a cached array, leaving it in place if it cannot be removed (e.g. memory-mapped on Windows)"""
+    _remove(_cache_path(cache_dir, name, key))
+
+
+def _remove(path):
+    try:
+        Path(path).unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def create_array(directory, shape, dtype):
+    """writeable memory map of a new column-major array in a temporary file of `directory` (by default the temporary
+    directory), filled in place (e.g. by several processes).
+
+    The file is removed once the memory map is garbage collected, unless it was moved into a cache by `publish_array`.
+    """
+    if directory is not None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".npy", dir=directory)
+    os.close(fd)
+    arr = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape, fortran_order=True)
+    weakref.finalize(arr, _remove, tmp)
+    return arr
+
+
+def publish_array(arr, cache_dir, name, key):
+    """move the file of a filled memory map of `create_array` in `cache_dir` into the cache, so the array is written
+    once and concurrent writers never expose a partial file to readers, and return it as a read-only memory map"""
+    arr.flush()
+    path = _cache_path(cache_dir, name, key)
+    os.replace(arr.filename, path)
+    return np.load(path, mmap_mode="r")
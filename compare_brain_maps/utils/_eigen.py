@@ -0,0 +1,84 @@
+"""laplace-beltrami eigenpairs of surface meshes"""
+
+from lapy import Solver, TriaMesh
+from sklearn.utils import check_random_state
+
+from ._cache import hash_arrays, list_keys, load_array, save_array
+
+
+def _eigs(fem, mesh, k, cache_dir=None, seed=None):
+    """eigenpairs of at least `k` modes, sliced from the smallest sufficient entry in `cache_dir`"""
+    if cache_dir is not None:
+        mesh_key = hash_arrays(mesh.coordinates, mesh.faces)
+        stored = sorted(int(key) for key in list_keys(cache_dir, f"emodes-{mesh_key}") if key.isdigit())
+        stored = [n for n in stored if n >= k]
+        if stored:
+            evals = load_array(cache_dir, f"evals-{mesh_key}", stored[0])
+            emodes = load_array(cache_dir, f"emodes-{mesh_key}", stored[0])
+            if evals is not None and emodes is not None:
+                return evals[:k], emodes[:, :k]
+
+    rng = check_random_state(seed)
+    evals, emodes = fem.eigs(k=k, rng=rng)
+    if cache_dir is not None:
+        evals = save_array(cache_dir, f"evals-{mesh_key}", k, evals)
+        emodes = save_array(cache_dir, f"emodes-{mesh_key}", k, emodes)
+    return evals, emodes
+
+
+def load_eigenpairs(mesh, n_modes, cache_dir=None, seed=None):
+    """Laplace-Beltrami eigenpairs of a surface mesh, excluding the constant first mode.
+
+    Parameters
+    ----------
+    mesh : nilearn.surface.SurfaceMesh
+        surface mesh (vertices and faces) of one hemisphere
+    n_modes : int
+        number of non-constant eigenmodes
+    cache_dir : str or pathlib.Path, optional
+        directory of eigenpairs persisted across processes and memory-mapped on load, by default None
+    seed : None, int or instance of RandomState, optional
+        seed for the random state generator, by default None
+
+    Returns
+    -------
+    evals : ndarray of shape (n_modes,)
+        eigenvalues
+    emodes : ndarray of shape (n_vertices, n_modes)
+        eigenmodes, orthonormal in the inner product of the FEM mass matrix
+    mass : scipy.sparse.csc_matrix of shape (n_vertices, n_vertices)
+        FEM mass matrix
+    """
+    tria_mesh = TriaMesh(v=mesh.coordinates, t=mesh.faces)
+    fem = Solver(geometry=tria_mesh, use_cholmod=True)  # requires scikit-sparse
+    evals, emodes = _eigs(fem, mesh, n_modes + 1, cache_dir, seed)
+    return evals[1:], emodes[:, 1:], fem.mass  # first is constant
+
+
+def load_mesh_eigenpairs(mesh, n_modes, stored=None, cache_dir=None, seed=None):
+    """Laplace-Beltrami eigenpairs of both hemispheres of a mesh, reusing `stored` eigenpairs if they have at least
+    `n_modes` modes on the same meshes, compared by content as in `cache_dir`.
+
+    Parameters
+    ----------
+    mesh : nilearn.surface.PolyMesh
+        surface meshes (vertices and faces) for both hemispheres
+    n_modes : int
+        number of non-constant eigenmodes
+    stored : tuple, optional
+        key and eigenpairs returned by a previous call, by default None
+    cache_dir, seed : optional
+        see `load_eigenpairs`
+
+    Returns
+    -------
+    key : tuple of str
+        hashes of the vertices and faces of the mesh of each hemisphere
+    eigenpairs : dict of tuple
+        eigenpairs (evals, emodes, mass) of `load_eigenpairs` per hemisphere, with at least `n_modes` modes
+    """
+    # meshes of other surfaces or atlases may have as many vertices (e.g. pial and inflated, fsaverage and civet)
+    key = tuple(hash_arrays(mesh.parts[hemi].coordinates, mesh.parts[hemi].faces) for hemi in ["left", "right"])
+    if stored is not None and stored[0] == key and all(pair[0].size >= n_modes for pair in stored[1].values()):
+        return stored
+    return key, {hemi: load_eigenpairs(mesh.parts[hemi], n_modes, cache_dir, seed) for hemi in ["left", "right"]}
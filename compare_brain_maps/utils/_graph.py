@@ -0,0 +1,88 @@
+"""graph traversal on sparse adjacency matrices"""
+
+import numpy as np
+from scipy import sparse
+
+
+def edge_lengths(A, coords):
+    """adjacency matrix `A` weighted by the euclidean length of each edge between `coords`"""
+    A = sparse.csr_array(A)
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    lengths = np.linalg.norm(coords[rows] - coords[A.indices], axis=1)
+    return sparse.csr_array((lengths, A.indices, A.indptr), shape=A.shape)
+
+
+def ball_search(A, sources, radius, weighted=False):
+    """shortest-path distances from each source to every vertex within `radius`.
+
+    Frontiers of all sources are expanded together over the CSR structure of `A`, so the cost scales with the
+    total size of the balls rather than with the number of vertices. With unit edge lengths this is a k-hop
+    breadth-first search, otherwise a label-correcting search that is exact for non-negative edge lengths.
+
+    Parameters
+    ----------
+    A : scipy.sparse array of shape (n_vertices, n_vertices)
+        adjacency matrix
+    sources : ndarray of shape (n_sources,)
+        source vertices
+    radius : float
+        maximum distance (number of hops if not `weighted`) from each source
+    weighted : bool, optional
+        if True, the entries of `A` are used as edge lengths, by default False
+
+    Returns
+    -------
+    rows : ndarray of shape (n_pairs,)
+        index into `sources` of each (source, vertex) pair
+    cols : ndarray of shape (n_pairs,)
+        vertex of each (source, vertex) pair
+    dist : ndarray of shape (n_pairs,)
+        shortest-path distance of each (source, vertex) pair
+    """
+    A = sparse.csr_array(A)
+    n_vertices = A.shape[0]
+    indptr, indices = A.indptr, A.indices
+    lengths = A.data.astype(float) if weighted else np.ones(len(indices))
+
+    # best known distances, keyed (and sorted) by source * n_vertices + vertex
+    keys = np.arange(len(sources), dtype=np.int64) * n_vertices + sources
+    order = np.argsort(keys)
+    keys, dist = keys[order], np.zeros(len(keys))
+    frontier_keys, frontier_dist = keys, dist
+
+    while len(frontier_keys):
+        # edges leaving the frontier
+        src, v = np.divmod(frontier_keys, n_vertices)
+        deg = indptr[v + 1] - indptr[v]
+        offsets = np.arange(deg.sum()) - np.repeat(np.cumsum(deg) - deg, deg)
+        edges = np.repeat(indptr[v], deg) + offsets
+        cand_dist = np.repeat(frontier_dist, deg) + lengths[edges]
+        inside = cand_dist <= radius
+        cand_keys = np.repeat(src, deg)[inside] * n_vertices + indices[edges][inside]
+        cand_dist = cand_dist[inside]
+
+        # shortest candidate per key
+        order = np.lexsort((cand_dist, cand_keys))
+        cand_keys, cand_dist = cand_keys[order], cand_dist[order]
+        first = np.ones(len(cand_keys), dtype=bool)
+        first[1:] = cand_keys[1:] != cand_keys[:-1]
+        cand_keys, cand_dist = cand_keys[first], cand_dist[first]
+
+        # keep candidates that are new or shorter than the best known distance
+        pos = np.searchsorted(keys, cand_keys)
+        found = pos < len(keys)
+        found[found] = keys[pos[found]] == cand_keys[found]
+        shorter = found.copy()
+        shorter[found] = cand_dist[found] < dist[pos[found]]
+        dist[pos[shorter]] = cand_dist[shorter]
+
+        new = ~found
+        keys = np.concatenate([keys, cand_keys[new]])
+        dist = np.concatenate([dist, cand_dist[new]])
+        order = np.argsort(keys, kind="stable")
+        keys, dist = keys[order], dist[order]
+
+        frontier_keys, frontier_dist = cand_keys[shorter | new], cand_dist[shorter | new]
+
+    rows, cols = np.divmod(keys, n_vertices)
+    return rows, cols, dist
@@ -0,0 +1,72 @@
+"""wall time and peak memory of named stages of a computation"""
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# (timings, open stages, whether the traced peak may be reset) of the innermost active profile
+_stack = ContextVar("profile_stack", default=None)
+
+
+@contextmanager
+def profile():
+    """collect the timings of every `stage` entered in this context.
+
+    Yields
+    ------
+    dict
+        filled as stages exit, with the total wall time in seconds ("time") and the peak memory in bytes traced by
+        `tracemalloc` in this process above the memory at the start of the stage ("memory"), per stage name; if
+        the caller traces memory, its peak is left untouched, so the memory of a stage is bounded by the caller's
+        peak so far instead
+    """
+    outer = _stack.get()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    timings = {}
+    token = _stack.set((timings, [], started or (outer is not None and outer[2])))
+    try:
+        yield timings
+    finally:
+        _stack.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(name):
+    """record the wall time and peak memory of a stage in the active `profile`, or do nothing outside of one.
+
+    Stages may be nested, and repeated stages accumulate time and keep the largest peak memory.
+    """
+    active = _stack.get()
+    if active is None or not tracemalloc.is_tracing():
+        yield
+        return
+    timings, frames, reset = active
+
+    # the traced peak is shared by nested stages, so the peak so far is handed to the enclosing stage before reset
+    current, peak = tracemalloc.get_traced_memory()
+    if frames:
+        frames[-1][1] = max(frames[-1][1], peak)
+    frame = [current, current]
+    frames.append(frame)
+    if reset:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+        frames.pop()
+        if frames:
+            frames[-1][1] = max(frames[-1][1], frame[1])
+        if reset:
+            tracemalloc.reset_peak()
+
+        record = timings.setdefault(name, {"time": 0.0, "memory": 0})
+        record["time"] += elapsed
+        record["memory"] = max(record["memory"], frame[1] - frame[0])
@@ -1,21 +1,28 @@
 """utilities for surface maps"""
 
 import copy
+from functools import lru_cache
 
 import numpy as np
 from neuromaps.datasets import fetch_atlas
-from nilearn.surface import PolyData, SurfaceImage, load_surf_data
+from nilearn.surface import InMemoryMesh, PolyData, PolyMesh, SurfaceImage, load_surf_data
 from nilearn.surface.surface import _check_data_and_mesh_compat
-from scipy.sparse import csr_array
+from scipy.sparse import csr_array, diags_array
 
+from ._cache import hash_arrays
 
-def _adjacency(faces, mask=None):
-    """return adjacency matrix for one hemisphere, optionally excluding the medial wall"""
+
+def _adjacency(faces, mask=None, compact=False):
+    """return adjacency matrix for one hemisphere, optionally excluding the medial wall, either of all vertices or
+    (if `compact`) of the vertices of `mask` only"""
     n_vertices = faces.max() + 1
 
     edges = np.vstack([faces[:, [0, 1]], faces[:, [0, 2]], faces[:, [1, 2]]])
-    sorted_edges = np.sort(edges, axis=1)
-    unique_edges = np.unique(sorted_edges, axis=0)
+    sorted_edges = np.sort(edges, axis=1).astype(np.int64)
+
+    # deduplicate edges as packed integer keys, much faster than a lexicographic sort of rows
+    keys = np.unique(sorted_edges[:, 0] * n_vertices + sorted_edges[:, 1])
+    unique_edges = np.column_stack(np.divmod(keys, n_vertices))
 
     if mask is not None:
         # filter out edges were either vertex is part of the medial wall
@@ -23,6 +30,9 @@ def _adjacency(faces, mask=None):
         unique_edges = unique_edges[valid_edges]
 
     i, j = unique_edges[:, 0], unique_edges[:, 1]
+    if compact and mask is not None:
+        index = np.cumsum(mask) - 1  # compact index of each vertex of the mask
+        i, j, n_vertices = index[i], index[j], int(mask.sum())
 
     ones = np.ones(len(unique_edges) * 2, dtype=np.int8)
     row_indices = np.concatenate([i, j])
@@ -31,6 +41,188 @@ def _adjacency(faces, mask=None):
     return csr_array((ones, (row_indices, col_indices)), shape=(n_vertices, n_vertices))
 
 
+class _SharedMesh(InMemoryMesh):
+    """mesh of one hemisphere sharing the read-only arrays of an atlas, whose coordinates are copied once, on first
+    access, into a writeable array of this mesh, since nilearn plotting centers them in place"""
+
+    def __init__(self, mesh):
+        self._atlas_coordinates = mesh.coordinates
+        self._coordinates = None
+        self._faces = mesh.faces
+        self.n_vertices = mesh.n_vertices
+
+    @property
+    def coordinates(self):
+        if self._coordinates is None:
+            self._coordinates = self._atlas_coordinates.copy()
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates(self, value):
+        self._coordinates = value
+
+
+@lru_cache(maxsize=8)
+def load_atlas(atlas, density, surface):
+    """Mesh and medial wall mask of a surface atlas, loaded once per process.
+
+    Loaded atlases are kept in a least-recently-used registry keyed by (atlas, density, surface), and their
+    arrays are read-only so they can be shared by reference between all `Surface` objects (whose meshes copy the
+    coordinates once if accessed, see `Surface.mesh`).
+
+    Returns
+    -------
+    mesh : nilearn.surface.PolyMesh
+        surface meshes (vertices and faces) for both hemispheres
+    medial : nilearn.surface.PolyData
+        surface mask (excluding medial wall) for both hemispheres
+    """
+    giftis = fetch_atlas(atlas, density, verbose=0)
+    mesh = PolyMesh(left=giftis[surface].L, right=giftis[surface].R)
+    medial = PolyData(
+        **{hemi: load_surf_data(gifti).astype(bool) for hemi, gifti in zip(["left", "right"], giftis["medial"])}
+    )
+    _check_data_and_mesh_compat(mesh, medial)
+
+    for hemi in ["left", "right"]:
+        mesh.parts[hemi].coordinates.flags.writeable = False
+        mesh.parts[hemi].faces.flags.writeable = False
+        medial.parts[hemi].flags.writeable = False
+    return mesh, medial
+
+
+@lru_cache(maxsize=32)
+def load_cortex(atlas, density, surface, mask_medial):
+    """Compact index space of the cortex of a surface atlas per hemisphere, built once per process.
+
+    If `mask_medial`, the cortex is the vertices of faces without medial wall vertices (the medial wall mask less any
+    vertex without a cortical face), otherwise every vertex.
+
+    Returns
+    -------
+    vertices : dict of numpy.ndarray of shape (n_cortex,)
+        vertex of each cortical vertex, mapping compact to full indices
+    index : dict of numpy.ndarray of shape (n_vertices,)
+        compact index of each vertex (`-1` outside the cortex), mapping full to compact indices
+    mesh : nilearn.surface.PolyMesh
+        mesh of the cortex, with faces in compact indices (the atlas mesh if not `mask_medial`)
+    """
+    mesh, medial = load_atlas(atlas, density, surface)
+    vertices, index, cortex_mesh = {}, {}, {}
+    for hemi in ["left", "right"]:
+        coordinates, faces = mesh.parts[hemi].coordinates, mesh.parts[hemi].faces
+        if mask_medial:
+            faces = faces[medial.parts[hemi][faces].all(axis=1)]
+            vertices[hemi] = np.unique(faces)
+            index[hemi] = np.full(len(coordinates), -1)
+            index[hemi][vertices[hemi]] = np.arange(len(vertices[hemi]))
+            cortex_mesh[hemi] = InMemoryMesh(coordinates=coordinates[vertices[hemi]], faces=index[hemi][faces])
+        else:
+            vertices[hemi] = np.arange(len(coordinates))
+            index[hemi] = vertices[hemi]
+            cortex_mesh[hemi] = mesh.parts[hemi]
+        for arr in [vertices[hemi], index[hemi], cortex_mesh[hemi].coordinates, cortex_mesh[hemi].faces]:
+            arr.flags.writeable = False
+    return vertices, index, PolyMesh(**cortex_mesh)
+
+
+def load_sphere(atlas, density, mask_medial=False):
+    """Spherical coordinates of shape (n_vertices, 3) and hemisphere labels of shape (n_vertices,) of an atlas,
+    with both hemispheres combined, optionally of the cortex only (see `load_cortex`)."""
+    _, _, sphere = load_cortex(atlas, density, "sphere", mask_medial)
+    coords = np.concatenate([sphere.parts["left"].coordinates, sphere.parts["right"].coordinates])
+    hemiid = np.repeat([0, 1], [sphere.parts["left"].n_vertices, sphere.parts["right"].n_vertices])
+    return coords, hemiid
+
+
+@lru_cache(maxsize=32)
+def load_graph(atlas, density, surface, mask_medial, operator="adjacency", compact=False):
+    """Graph operators of a surface atlas per hemisphere, built once per process and shared between surfaces.
+
+    Parameters
+    ----------
+    operator : str, optional
+        one of `{"adjacency", "degree", "transition", "laplacian"}`, by default "adjacency"
+    compact : bool, optional
+        if True, operators of the cortical vertices only, in the compact index space of `load_cortex`,
+        by default False
+
+    Returns
+    -------
+    dict of scipy.sparse.csr_array or numpy.ndarray
+        operator per hemisphere, optionally excluding the medial wall
+    """
+    if operator not in {"adjacency", "degree", "transition", "laplacian"}:
+        raise ValueError(f"operator must be one of 'adjacency', 'degree', 'transition', 'laplacian', got {operator}")
+
+    if operator == "adjacency":
+        mesh, _ = load_atlas(atlas, density, surface)
+        vertices, _, _ = load_cortex(atlas, density, surface, mask_medial)
+        A = {}
+        for hemi in ["left", "right"]:
+            mask = None
+            if mask_medial:
+                mask = np.zeros(mesh.parts[hemi].n_vertices, dtype=bool)
+                mask[vertices[hemi]] = True
+            A[hemi] = _adjacency(mesh.parts[hemi].faces, mask, compact)
+        return A
+
+    A = load_graph(atlas, density, surface, mask_medial, compact=compact)
+    if operator == "degree":
+        return {hemi: A[hemi].sum(axis=1) for hemi in A}
+
+    D = load_graph(atlas, density, surface, mask_medial, "degree", compact)
+    if operator == "transition":
+        # vertices without neighbors (the masked medial wall) have all-zero rows
+        return {hemi: csr_array(diags_array(1 / np.maximum(D[hemi], 1)) @ A[hemi]) for hemi in A}
+    return {hemi: csr_array(diags_array(D[hemi].astype(float)) - A[hemi]) for hemi in A}
+
+
+class _Labels:
+    """parcel labels per hemisphere, hashed and compared by their content hash `key` so that they can key a cache"""
+
+    def __init__(self, labels, key):
+        self.labels = labels
+        self.key = key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, _Labels) and self.key == other.key
+
+
+@lru_cache(maxsize=32)
+def load_parcels(atlas, density, surface, mask_medial, parcellation):
+    """Sparse operators averaging the vertices of each parcel of a surface atlas, built once per process and shared
+    between surfaces with the same parcellation.
+
+    Unassigned vertices (label `0`) and, if `mask_medial`, vertices outside the cortex (see `load_cortex`) are
+    excluded from the averages.
+
+    Parameters
+    ----------
+    parcellation : _Labels
+        integer parcel labels per vertex for both hemispheres, keyed by their content hash
+
+    Returns
+    -------
+    labels : dict of numpy.ndarray of shape (n_parcels,)
+        sorted parcel labels per hemisphere
+    P : dict of scipy.sparse.csr_array of shape (n_parcels, n_vertices)
+        averaging operators per hemisphere, whose rows sum to 1
+    """
+    vertices, _, _ = load_cortex(atlas, density, surface, mask_medial)
+    labels, P = {}, {}
+    for hemi, hemi_labels in parcellation.labels.items():
+        cols = vertices[hemi][hemi_labels[vertices[hemi]] != 0]
+        labels[hemi], rows = np.unique(hemi_labels[cols], return_inverse=True)
+        weights = 1 / np.bincount(rows)[rows]
+        P[hemi] = csr_array((weights, (rows, cols)), shape=(len(labels[hemi]), len(hemi_labels)))
+        labels[hemi].flags.writeable = False
+    return labels, P
+
+
 class Surface(SurfaceImage):
     """Surface object containing data, mesh, and medial wall mask for both hemispheres.
 
@@ -50,7 +242,11 @@ class Surface(SurfaceImage):
         fsaverage in `{"white", "pial", "inflated", "sphere"}`\\
         fsLR in `{"midthickness", "inflated", "sphere"}`
     mask_medial : bool, optional
-        if True, excludes the medial wall of data and adjacency matrices, by default False
+        if True, excludes the medial wall of data and adjacency matrices, and estimators work on the cortical
+        vertices only (see `get_cortex`), by default False
+    parcellation : dict of numpy.1darray or str or pathlib.Path, optional
+        dictionary of integer parcel labels per vertex (`0` for unassigned vertices) or label giftis, whose keys
+        must be {"left", "right"}; if set, resamplers work on parcel means (see `parcellate`), by default None
 
     Attributes
     ----------
@@ -59,7 +255,11 @@ class Surface(SurfaceImage):
     medial : nilearn.surface.PolyData
         surface mask (excluding medial wall) for both hemispheres
     mesh : nilearn.surface.PolyMesh
-        surface meshes (vertices and faces) for both hemispheres
+        surface meshes (vertices and faces) for both hemispheres, sharing the read-only faces of the atlas and
+        copying its coordinates on first access into writeable coordinates of this surface, so surfaces can be
+        passed to nilearn plotting
+    parcellation : dict of numpy.ndarray or None
+        read-only integer parcel labels per vertex for both hemispheres
     shape : tuple
         total number of vertices for both hemispheres
 
@@ -77,24 +277,193 @@ class Surface(SurfaceImage):
     (5124,)
     """
 
-    def __init__(self, data, atlas="fsaverage", density="3k", surface="pial", mask_medial=False):
-        giftis = fetch_atlas(atlas, density, verbose=0)
-        super().__init__(data=copy.deepcopy(data), mesh={"left": giftis[surface].L, "right": giftis[surface].R})
+    def __init__(self, data, atlas="fsaverage", density="3k", surface="pial", mask_medial=False, parcellation=None):
+        mesh, medial = load_atlas(atlas, density, surface)  # shared between surfaces of the same atlas
+        mesh = PolyMesh(**{hemi: _SharedMesh(part) for hemi, part in mesh.parts.items()})
+        super().__init__(data=copy.deepcopy(data), mesh=mesh)
         self.atlas = atlas
         self.density = density
+        self.surface = surface
         self.mask_medial = mask_medial
+        self.parcellation = None
+        self._parcellation_key = None  # content hash of the parcellation, keying shared parcel operators
+        if parcellation is not None:
+            self.parcellation = {
+                hemi: load_surf_data(parcellation[hemi]).astype(np.int64) for hemi in ["left", "right"]
+            }
+            _check_data_and_mesh_compat(mesh, PolyData(**self.parcellation))
+            for labels in self.parcellation.values():
+                labels.flags.writeable = False  # hashed once
+            self._parcellation_key = hash_arrays(self.parcellation["left"], self.parcellation["right"])
 
-        medial = {hemi: load_surf_data(gifti).astype(bool) for hemi, gifti in zip(["left", "right"], giftis["medial"])}
         if mask_medial:
-            for hemi, mask in medial.items():
+            for hemi, mask in medial.parts.items():
                 self.data.parts[hemi][~mask] = np.nan
 
-        self.medial = PolyData(**medial)
-        _check_data_and_mesh_compat(self.mesh, self.medial)
+        self.medial = medial
+
+    def with_data(self, data):
+        """Surface with new data that shares the mesh, medial wall mask and cached graph operators of this surface.
 
-    def get_adjacency(self):
+        Parameters
+        ----------
+        data : dict of numpy.ndarray
+            dictionary of data arrays whose keys must be a subset of {"left", "right"}, used without copying or
+            masking the medial wall
+
+        Returns
+        -------
+        Surface
+            surface object with `data` on the mesh of this surface
+        """
+        X = copy.copy(self)
+        X.data = PolyData(**data)
+        _check_data_and_mesh_compat(X.mesh, X.data)
+        return X
+
+    def get_cortex(self):
+        """Compact index space of the cortical vertices, which is every vertex unless `mask_medial`.
+
+        Returns
+        -------
+        vertices : dict of numpy.ndarray of shape (n_cortex,)
+            vertex of each cortical vertex per hemisphere, mapping compact to full indices
+        index : dict of numpy.ndarray of shape (n_vertices,)
+            compact index of each vertex per hemisphere (`-1` outside the cortex), mapping full to compact indices
+        mesh : nilearn.surface.PolyMesh
+            mesh of the cortex, with faces in compact indices
+        """
+        return load_cortex(self.atlas, self.density, self.surface, self.mask_medial)
+
+    def compress(self):
+        """Data of the cortical vertices only, without the masked medial wall.
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_cortex[, n_maps])
+            dictionary of data arrays per hemisphere, in the compact index space of `get_cortex`
+        """
+        if not self.mask_medial:
+            return dict(self.data.parts)
+        vertices, _, _ = self.get_cortex()
+        return {hemi: data[vertices[hemi]] for hemi, data in self.data.parts.items()}
+
+    def expand(self, data):
+        """Surface with data of the cortical vertices only, filled with NaN outside the cortex.
+
+        Parameters
+        ----------
+        data : dict of numpy.ndarray of shape (n_cortex[, n_maps])
+            dictionary of data arrays per hemisphere, in the compact index space of `get_cortex`
+
+        Returns
+        -------
+        Surface
+            surface object with data of shape (n_vertices[, n_maps]) on the mesh of this surface
+        """
+        if not self.mask_medial:
+            return self.with_data(data)
+        vertices, index, _ = self.get_cortex()
+        full_data = {}
+        for hemi, arr in data.items():
+            full_data[hemi] = np.full((len(index[hemi]),) + arr.shape[1:], np.nan)
+            full_data[hemi][vertices[hemi]] = arr
+        return self.with_data(full_data)
+
+    def get_coordinates(self):
+        """Coordinates of the cortical vertices (see `get_cortex`).
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_cortex, 3)
+            dictionary of vertex coordinates per hemisphere, in the compact index space of `get_cortex`
+        """
+        _, _, mesh = self.get_cortex()
+        return {hemi: mesh.parts[hemi].coordinates for hemi in ["left", "right"]}
+
+    def get_parcels(self):
+        """Sparse operators averaging the vertices of each parcel, shared between surfaces of the same atlas,
+        medial wall mask and parcellation (see `load_parcels`). Operators must not be modified in place.
+
+        Returns
+        -------
+        labels : dict of numpy.ndarray of shape (n_parcels,)
+            sorted parcel labels per hemisphere
+        P : dict of scipy.sparse.csr_array of shape (n_parcels, n_vertices)
+            averaging operators per hemisphere, whose rows sum to 1
+        """
+        if self.parcellation is None:
+            raise ValueError("Surface has no parcellation")
+        parcellation = _Labels(self.parcellation, self._parcellation_key)
+        return load_parcels(self.atlas, self.density, self.surface, self.mask_medial, parcellation)
+
+    def parcellate(self):
+        """Mean of the data of each parcel.
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_parcels[, n_maps])
+            dictionary of parcel means per hemisphere, ordered as the labels of `get_parcels`
+        """
+        _, P = self.get_parcels()
+        return {
+            hemi: (P[hemi] @ data.reshape(data.shape[0], -1)).reshape((P[hemi].shape[0],) + data.shape[1:])
+            for hemi, data in self.data.parts.items()
+        }
+
+    def get_parcel_centroids(self, surface=None):
+        """Mean coordinates of the vertices of each parcel, projected back onto the sphere if `surface` is "sphere".
+
+        Parameters
+        ----------
+        surface : str, optional
+            surface of the atlas whose coordinates are averaged, by default the surface of this object
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_parcels, 3)
+            dictionary of parcel centroids per hemisphere
+        """
+        _, P = self.get_parcels()
+        mesh, _ = load_atlas(self.atlas, self.density, self.surface if surface is None else surface)
+        centroids = {}
+        for hemi in ["left", "right"]:
+            coordinates = mesh.parts[hemi].coordinates
+            centroids[hemi] = P[hemi] @ coordinates
+            if surface == "sphere":
+                radius = np.linalg.norm(coordinates, axis=1).mean()
+                centroids[hemi] *= radius / np.linalg.norm(centroids[hemi], axis=1, keepdims=True)
+        return centroids
+
+    def get_parcel_adjacency(self):
+        """Adjacency matrices of parcels sharing a mesh edge, for the left and right hemispheres.
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_parcels, n_parcels)
+            dictionary of sparse parcel adjacency matrices per hemisphere
+        """
+        _, P = self.get_parcels()
+        A = self.get_adjacency()
+        A_parcels = {}
+        for hemi in ["left", "right"]:
+            membership = csr_array(P[hemi] > 0, dtype=np.int64)
+            A_hemi = csr_array(membership @ A[hemi] @ membership.T)
+            A_hemi.setdiag(0)
+            A_hemi.eliminate_zeros()
+            A_parcels[hemi] = csr_array((A_hemi > 0).astype(np.int8))
+        return A_parcels
+
+    def get_adjacency(self, compact=False):
         """Adjacency matrices for the left and right hemispheres of a surface atlas.
-        Elements *i,j* are `1` if vertex pairs are adjacent, `0` otherwise.
+        Elements *i,j* are `1` if vertex pairs are adjacent, `0` otherwise. Matrices are cached per atlas and
+        shared between surfaces, so they must not be modified in place.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            if True, matrices of shape (n_cortex, n_cortex) in the compact index space of `get_cortex`,
+            by default False
 
         Returns
         -------
@@ -103,12 +472,50 @@ class Surface(SurfaceImage):
             - "left": csr_array for the left hemisphere
             - "right": csr_array for the right hemisphere
         """
-        A_left = _adjacency(
-            self.mesh.parts["left"].faces,
-            self.medial.parts["left"] if self.mask_medial else None,
-        )
-        A_right = _adjacency(
-            self.mesh.parts["right"].faces,
-            self.medial.parts["right"] if self.mask_medial else None,
-        )
-        return {"left": A_left, "right": A_right}
+        return dict(load_graph(self.atlas, self.density, self.surface, self.mask_medial, compact=compact))
+
+    def get_degree(self, compact=False):
+        """Number of neighbors of each vertex for the left and right hemispheres of a surface atlas.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            if True, of the cortical vertices only (see `get_cortex`), by default False
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_vertices,)
+            dictionary of vertex degrees per hemisphere, excluding the medial wall
+        """
+        return dict(load_graph(self.atlas, self.density, self.surface, self.mask_medial, "degree", compact))
+
+    def get_transition(self, compact=False):
+        """Row-normalized adjacency matrices for the left and right hemispheres of a surface atlas.
+        Elements *i,j* are `1 / degree(i)` if vertex pairs are adjacent, `0` otherwise.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            if True, of the cortical vertices only (see `get_cortex`), by default False
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_vertices, n_vertices)
+            dictionary of sparse transition matrices per hemisphere, excluding the medial wall
+        """
+        return dict(load_graph(self.atlas, self.density, self.surface, self.mask_medial, "transition", compact))
+
+    def get_laplacian(self, compact=False):
+        """Graph Laplacian matrices (degree minus adjacency) for the left and right hemispheres of a surface atlas.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            if True, of the cortical vertices only (see `get_cortex`), by default False
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_vertices, n_vertices)
+            dictionary of sparse graph Laplacians per hemisphere, excluding the medial wall
+        """
+        return dict(load_graph(self.atlas, self.density, self.surface, self.mask_medial, "laplacian", compact))
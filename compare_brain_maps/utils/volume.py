@@ -1 +1,274 @@
 """utilities for volume maps"""
+
+import copy
+import itertools
+
+import nibabel as nib
+import numpy as np
+from scipy.sparse import csr_array, diags_array
+
+
+def _load_img(img):
+    """nifti image from a path, memory-mapped instead of loaded if uncompressed, or an image as is"""
+    if isinstance(img, nib.spatialimages.SpatialImage):
+        return img
+    return nib.load(img, mmap=True)
+
+
+def _load_mask(mask):
+    """boolean mask and affine of a 3d image or path, or of an array with an identity affine"""
+    if isinstance(mask, np.ndarray):
+        return mask.astype(bool), np.eye(4)
+    mask = _load_img(mask)
+    return np.asanyarray(mask.dataobj).astype(bool), mask.affine
+
+
+def _offsets(connectivity):
+    """voxel offsets of half of the 6, 18 or 26-neighborhood, one of each pair of opposite offsets"""
+    if connectivity not in {6, 18, 26}:
+        raise ValueError(f"connectivity must be one of 6, 18, 26, got {connectivity}")
+    max_norm = {6: 1, 18: 2, 26: 3}[connectivity]  # squared euclidean length of the offsets
+    return [
+        offset
+        for offset in itertools.product([-1, 0, 1], repeat=3)
+        if 0 < np.sum(np.square(offset)) <= max_norm and offset > (0, 0, 0)
+    ]
+
+
+def _grid_adjacency(ijk, shape, connectivity=6):
+    """adjacency matrix of the voxels `ijk` of shape (n_voxels, 3) in a grid of `shape`, in the order of `ijk`"""
+    index = np.full(shape, -1, dtype=np.int64)  # compact index of each voxel (`-1` outside the mask)
+    index[tuple(ijk.T)] = np.arange(len(ijk))
+
+    rows, cols = [], []
+    for offset in _offsets(connectivity):
+        neighbors = ijk + offset
+        inside = np.all((neighbors >= 0) & (neighbors < shape), axis=1)
+        j = np.full(len(ijk), -1, dtype=np.int64)
+        j[inside] = index[tuple(neighbors[inside].T)]
+        rows.append(np.flatnonzero(j >= 0))
+        cols.append(j[j >= 0])
+    i, j = np.concatenate(rows), np.concatenate(cols)
+
+    ones = np.ones(len(i) * 2, dtype=np.int8)
+    return csr_array((ones, (np.concatenate([i, j]), np.concatenate([j, i]))), shape=(len(ijk), len(ijk)))
+
+
+class Volume:
+    """Volume object containing the data of the voxels of a mask, the counterpart of `Surface` for voxelwise maps.
+
+    Images are memory-mapped rather than loaded, and only the voxels of the mask are read and stored, as a compact
+    array with one row per voxel. Estimators see a single part "volume" in place of the two hemispheres.
+
+    Parameters
+    ----------
+    img : str or pathlib.Path or nibabel.spatialimages.SpatialImage or numpy.ndarray
+        3d image of one map or 4d image of `n_maps` maps, or an array of shape (n_voxels[, n_maps]) of the
+        voxels of `mask` in C order
+    mask : str or pathlib.Path or nibabel.spatialimages.SpatialImage or numpy.ndarray, optional
+        3d image of the voxels to keep, by default the finite non-zero voxels of the first map (required if `img` is
+        an array of voxels)
+    connectivity : int, optional
+        neighborhood of each voxel in `{6, 18, 26}`, sharing a face, an edge or a corner, by default 6
+
+    Attributes
+    ----------
+    data : numpy.ndarray of shape (n_voxels[, n_maps])
+        data of the voxels of the mask
+    affine : numpy.ndarray of shape (4, 4)
+        voxel to world coordinates transform
+    mask : numpy.ndarray of shape (n_i, n_j, n_k)
+        boolean mask of the voxels in the image grid
+    parcellation : None
+        volumes are not parcellated
+    shape : tuple
+        number of voxels of the mask
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import nibabel as nib
+    >>> from compare_brain_maps.utils.volume import Volume
+    >>> img = nib.Nifti1Image(np.random.randn(10, 10, 10), affine=np.eye(4))
+    >>> X = Volume(img, mask=np.ones((10, 10, 10)))
+    >>> X.shape
+    (1000,)
+    """
+
+    parcellation = None
+
+    def __init__(self, img, mask=None, connectivity=6):
+        self.connectivity = connectivity
+        _offsets(connectivity)  # check connectivity
+
+        if isinstance(img, np.ndarray):
+            if mask is None:
+                raise ValueError("mask is required if img is an array of voxels")
+            self.mask, self.affine = _load_mask(mask)
+            if len(img) != self.mask.sum():
+                raise ValueError(f"img must have one row per voxel of mask, got {len(img)} and {self.mask.sum()}")
+            self.data = np.array(img, dtype=float)
+            return
+
+        img = _load_img(img)
+        self.affine = img.affine
+        n_maps = img.shape[3] if len(img.shape) == 4 else None
+        first = np.asanyarray(img.dataobj if n_maps is None else img.dataobj[..., 0])
+        self.mask = np.isfinite(first) & (first != 0) if mask is None else _load_mask(mask)[0]
+        if self.mask.shape != img.shape[:3]:
+            raise ValueError(f"mask must have the grid shape of img, got {self.mask.shape} and {img.shape[:3]}")
+
+        # one map at a time is read from the memory-mapped image, keeping only the voxels of the mask
+        if n_maps is None:
+            self.data = np.asarray(first[self.mask], dtype=float)
+        else:
+            self.data = np.empty((int(self.mask.sum()), n_maps))
+            for t in range(n_maps):
+                self.data[:, t] = np.asanyarray(img.dataobj[..., t])[self.mask]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def with_data(self, data):
+        """Volume with new data that shares the mask and cached graph operators of this volume.
+
+        Parameters
+        ----------
+        data : numpy.ndarray of shape (n_voxels[, n_maps])
+            data of the voxels of the mask, used without copying
+
+        Returns
+        -------
+        Volume
+            volume object with `data` on the mask of this volume
+        """
+        if len(data) != len(self.data):
+            raise ValueError(f"data must have one row per voxel of the mask, got {len(data)} and {len(self.data)}")
+        X = copy.copy(self)
+        X.data = data
+        return X
+
+    def compress(self):
+        """Data of the voxels of the mask, as the single part "volume".
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_voxels[, n_maps])
+            dictionary of the data array
+        """
+        return {"volume": self.data}
+
+    def expand(self, data):
+        """Volume with data of the voxels of the mask.
+
+        Parameters
+        ----------
+        data : dict of numpy.ndarray of shape (n_voxels[, n_maps])
+            dictionary of the data array of the part "volume"
+
+        Returns
+        -------
+        Volume
+            volume object with `data` on the mask of this volume
+        """
+        return self.with_data(data["volume"])
+
+    def to_img(self):
+        """Nifti image of the data, filled with NaN outside the mask.
+
+        Returns
+        -------
+        nibabel.Nifti1Image
+            3d image, or 4d image of `n_maps` maps
+        """
+        img = np.full(self.mask.shape + self.data.shape[1:], np.nan)
+        img[self.mask] = self.data
+        return nib.Nifti1Image(img, self.affine)
+
+    def get_coordinates(self):
+        """World coordinates of the voxels of the mask.
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_voxels, 3)
+            dictionary of the coordinates of the part "volume"
+        """
+        ijk = np.argwhere(self.mask)
+        return {"volume": ijk @ self.affine[:3, :3].T + self.affine[:3, 3]}
+
+    def _get_graph(self, operator):
+        """graph operator of the voxels of the mask, built once per volume and shared by `with_data`"""
+        graphs = self.__dict__.setdefault("_graphs", {})
+        if operator not in graphs:
+            if operator == "adjacency":
+                graphs[operator] = _grid_adjacency(np.argwhere(self.mask), self.mask.shape, self.connectivity)
+            elif operator == "degree":
+                graphs[operator] = self._get_graph("adjacency").sum(axis=1)
+            elif operator == "transition":
+                D = self._get_graph("degree")
+                graphs[operator] = csr_array(diags_array(1 / np.maximum(D, 1)) @ self._get_graph("adjacency"))
+            else:
+                D = self._get_graph("degree")
+                graphs[operator] = csr_array(diags_array(D.astype(float)) - self._get_graph("adjacency"))
+        return graphs[operator]
+
+    def get_adjacency(self, compact=True):
+        """Adjacency matrix of the voxels of the mask, which are neighbors if within the `connectivity` neighborhood.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            ignored, volumes are always in the compact index space of the mask, by default True
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_voxels, n_voxels)
+            dictionary of the sparse adjacency matrix of the part "volume"
+        """
+        return {"volume": self._get_graph("adjacency")}
+
+    def get_degree(self, compact=True):
+        """Number of neighbors of each voxel of the mask.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            ignored, volumes are always in the compact index space of the mask, by default True
+
+        Returns
+        -------
+        dict of numpy.ndarray of shape (n_voxels,)
+            dictionary of voxel degrees of the part "volume"
+        """
+        return {"volume": self._get_graph("degree")}
+
+    def get_transition(self, compact=True):
+        """Row-normalized adjacency matrix of the voxels of the mask.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            ignored, volumes are always in the compact index space of the mask, by default True
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_voxels, n_voxels)
+            dictionary of the sparse transition matrix of the part "volume"
+        """
+        return {"volume": self._get_graph("transition")}
+
+    def get_laplacian(self, compact=True):
+        """Graph Laplacian matrix (degree minus adjacency) of the voxels of the mask.
+
+        Parameters
+        ----------
+        compact : bool, optional
+            ignored, volumes are always in the compact index space of the mask, by default True
+
+        Returns
+        -------
+        dict of scipy.sparse.csr_array of shape (n_voxels, n_voxels)
+            dictionary of the sparse graph Laplacian of the part "volume"
+        """
+        return {"volume": self._get_graph("laplacian")}
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from compare_brain_maps.batch import load_results, main, run_batch
+from compare_brain_maps.resampling import PermutationResampler, SubsampleResampler
+from compare_brain_maps.utils import Surface
+
+
+def _write_manifest(tmp_path, n_pairs, n_vertices=2562):
+    """csv manifest of pairs of random maps saved as giftis"""
+    rng = np.random.default_rng(seed=0)
+    lines = ["id,x_left,x_right,y_left,y_right"]
+    for i in range(n_pairs):
+        paths = []
+        for name in ["x_left", "x_right", "y_left", "y_right"]:
+            path = str(tmp_path / f"{name}-{i}.gii")
+            array = nib.gifti.GiftiDataArray(rng.normal(size=n_vertices).astype(np.float32))
+            nib.save(nib.gifti.GiftiImage(darrays=[array]), path)
+            paths.append(path)
+        lines.append(",".join([f"pair-{i}"] + paths))
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("\n".join(lines) + "\n")
+    return manifest
+
+
+@pytest.mark.parametrize(
+    "method, resampler",
+    [
+        ("permutation", PermutationResampler(n_permutations=10, seed=0)),
+        ("subsample", SubsampleResampler(n_subsamples=10, seed=0)),
+    ],
+)
+def test_run_batch(tmp_path, method, resampler):
+    """test a sharded batch run matches single fits, and resumes from its missing chunks"""
+    manifest = _write_manifest(tmp_path, n_pairs=5)
+    output_dir = tmp_path / "results"
+    kwargs = dict(method=method, n_draws=10, surface="inflated", chunk_size=2, n_jobs=2, seed=0)
+
+    written = run_batch(manifest, output_dir, **kwargs)
+    assert len(written) == 3, "pairs not split into chunks"
+    results = load_results(output_dir)
+    np.testing.assert_array_equal(results["id"], [f"pair-{i}" for i in range(5)])
+
+    for i in [0, 4]:
+        X = Surface({hemi: str(tmp_path / f"x_{hemi}-{i}.gii") for hemi in ["left", "right"]}, surface="inflated")
+        Y = Surface({hemi: str(tmp_path / f"y_{hemi}-{i}.gii") for hemi in ["left", "right"]}, surface="inflated")
+        resampler.fit(X, Y)
+        np.testing.assert_allclose(results["param"][i], resampler.param_)
+        np.testing.assert_allclose(results["params"][i], resampler.params_)
+
+    # an interrupted run resumes from its missing chunks
+    os.remove(written[1])
+    assert run_batch(manifest, output_dir, **kwargs) == [written[1]]
+    np.testing.assert_array_equal(load_results(output_dir)["params"], results["params"])
+    assert run_batch(manifest, output_dir, **kwargs) == []
+
+    with pytest.raises(ValueError):
+        main([str(manifest), str(output_dir), "--method", method, "--n-draws", "20", "--quiet"])
+
+
+def test_batch_shared_memory(tmp_path):
+    """test the command line runner releases its shared memory without resource tracker errors"""
+    manifest = _write_manifest(tmp_path, n_pairs=4)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+    args = [str(manifest), str(tmp_path / "results"), "--n-draws", "10", "--surface", "inflated"]
+    result = subprocess.run(
+        [sys.executable, "-m", "compare_brain_maps.batch", *args, "--chunk-size", "1", "--n-jobs", "2", "--quiet"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "Traceback" not in result.stderr and "leaked" not in result.stderr, result.stderr
+    assert len(load_results(tmp_path / "results")["id"]) == 4
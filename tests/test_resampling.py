@@ -1,8 +1,19 @@
 import numpy as np
 import pytest
+from scipy.spatial import cKDTree
+from sklearn.base import clone
 
-from compare_brain_maps.resampling import PermutationResampler, SubsampleResampler
-from compare_brain_maps.utils import Surface
+from compare_brain_maps.resampling import (
+    BootstrapResampler,
+    EigenstrapResampler,
+    PermutationResampler,
+    SubsampleResampler,
+)
+from compare_brain_maps.resampling._base import _stat_maps
+from compare_brain_maps.resampling.permutation import _random_rotation, _spin_block
+from compare_brain_maps.utils import Surface, Volume
+from compare_brain_maps.utils._cache import create_array
+from compare_brain_maps.utils.surface import load_atlas, load_sphere
 
 atlas_density_params = [
     ("fsaverage", "3k", 2562),
@@ -50,3 +61,519 @@ def test_permutation_resampler(atlas, density, n_vertices):
 
     np.testing.assert_allclose(resampler.param_, 0, atol=0.015)
     np.testing.assert_allclose(np.mean(resampler.params_), 0, atol=0.005)
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_permutation_resampler_chunks(atlas, density, n_vertices):
+    """test chunked correlations match a single chunk of all permutations"""
+    rng = np.random.default_rng(seed=0)
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+
+    resampler = PermutationResampler(n_permutations=10, seed=0, max_memory=None).fit(X, Y)
+    resampler_chunked = PermutationResampler(n_permutations=10, seed=0, chunk_size=3).fit(X, Y)
+
+    np.testing.assert_allclose(resampler.params_, resampler_chunked.params_)
+    for permutation in range(10):
+        idx = resampler._spins[:, permutation]
+        X_n, Y_n = np.concatenate([X_data["left"], X_data["right"]]), np.concatenate([Y_data["left"], Y_data["right"]])
+        np.testing.assert_allclose(resampler.params_[permutation], np.corrcoef(X_n[idx], Y_n)[0, 1])
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=10, seed=0),
+        SubsampleResampler(n_subsamples=10, seed=0),
+        BootstrapResampler(n_bootstraps=10, n_blocks=20, seed=0),
+        EigenstrapResampler(n_surrogates=10, n_modes=100, seed=0),
+    ],
+)
+def test_fit_many(resampler):
+    """test many-vs-many fit matches pairwise calls to fit"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices, n_X, n_Y = 2562, 3, 2
+
+    X_data = {"left": rng.normal(size=(n_vertices, n_X)), "right": rng.normal(size=(n_vertices, n_X))}
+    Y_data = {"left": rng.normal(size=(n_vertices, n_Y)), "right": rng.normal(size=(n_vertices, n_Y))}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    resampler.fit_many(X, Y)
+    param_, params_, null_ = resampler.param_, resampler.params_, resampler.null_
+    assert params_.shape == (n_X, n_Y, 10), "incorrect shape of params_"
+
+    for i in range(n_X):
+        for j in range(n_Y):
+            X_ij = Surface({hemi: X_data[hemi][:, i] for hemi in X_data}, atlas="fsaverage", density="3k")
+            Y_ij = Surface({hemi: Y_data[hemi][:, j] for hemi in Y_data}, atlas="fsaverage", density="3k")
+            resampler.fit(X_ij, Y_ij)
+            np.testing.assert_allclose(param_[i, j], resampler.param_)
+            np.testing.assert_allclose(params_[i, j], resampler.params_)
+            assert null_[i, j] == resampler.null_
+
+
+def test_permutation_resampler_cache(tmp_path):
+    """test spins persist on disk across cloned estimators and are memory-mapped on load"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    resampler = PermutationResampler(n_permutations=10, seed=0, cache_dir=tmp_path).fit(X, Y)
+    assert len(list(tmp_path.glob("spins-*.npy"))) == 1, "spins not cached"
+
+    resampler_cloned = clone(resampler).fit(X, Y)
+    assert isinstance(resampler_cloned._spins, np.memmap), "cached spins not memory-mapped"
+    assert not resampler_cloned._spins.flags.writeable, "cached spins are writeable"
+    np.testing.assert_array_equal(resampler._spins, resampler_cloned._spins)
+    np.testing.assert_allclose(resampler.params_, resampler_cloned.params_)
+
+
+def test_permutation_resampler_cache_batches(tmp_path, monkeypatch):
+    """test batches write spins once into one cache entry per fit, and cached batches match stored spins"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    shapes = []
+
+    def record_shape(directory, shape, dtype):
+        shapes.append(shape)
+        return create_array(directory, shape, dtype)
+
+    monkeypatch.setattr("compare_brain_maps.resampling.permutation.create_array", record_shape)
+    # a wide central interval is not settled by a few hundred draws, so every batch is scored
+    resampler = PermutationResampler(
+        n_permutations=300, alpha=0.9, reuse_spins=False, cache_dir=tmp_path, batch_size=50, seed=0
+    ).fit(X, Y)
+    assert resampler.n_draws_ == 300, "sequential resampling stopped early"
+    assert shapes == [(2 * n_vertices, 300)], "spins not preallocated once"
+    assert [path.name.rsplit("-", 1)[-1] for path in tmp_path.glob("*.npy")] == ["300.npy"], "batches not merged"
+
+    resampler_cached = PermutationResampler(n_permutations=300, alpha=0.9, cache_dir=tmp_path, seed=0).fit(X, Y)
+    resampler_full = PermutationResampler(n_permutations=300, alpha=0.9, seed=0).fit(X, Y)
+    assert isinstance(resampler_cached._spins, np.memmap), "cached spins not memory-mapped"
+    np.testing.assert_array_equal(resampler_cached._spins, resampler_full._spins)
+    np.testing.assert_allclose(resampler.params_, resampler_full.params_)
+
+    # a fit of more permutations extends, and replaces, the cache entry
+    resampler_more = PermutationResampler(n_permutations=400, alpha=0.9, cache_dir=tmp_path, seed=0).fit(X, Y)
+    assert [path.name.rsplit("-", 1)[-1] for path in tmp_path.glob("*.npy")] == ["400.npy"], "entry not replaced"
+    np.testing.assert_array_equal(resampler_more._spins[:, :300], resampler_full._spins)
+
+
+def test_permutation_resampler_n_jobs(tmp_path, monkeypatch):
+    """test spins are identical for any number of processes, also if written straight into the cache"""
+    n_vertices = 2562
+    data = {"left": np.ones(n_vertices), "right": np.ones(n_vertices)}
+    X = Surface(data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    resampler = PermutationResampler(n_permutations=10, n_jobs=2)
+    assert resampler._n_workers(10, 2 * n_vertices) == 1, "few spins generated by several processes"
+    # one permutation per process, so a few spins are generated by several processes
+    monkeypatch.setattr("compare_brain_maps.resampling.permutation._WORKER_QUERIES", 1)
+    assert resampler._n_workers(10, 2 * n_vertices) == 2, "spins not generated by several processes"
+    spins = [PermutationResampler(n_permutations=10, seed=0, n_jobs=n_jobs)._spin_vertices(X) for n_jobs in [1, 2, 3]]
+    spins.append(PermutationResampler(n_permutations=10, seed=0, n_jobs=2, cache_dir=tmp_path)._spin_vertices(X))
+    assert isinstance(spins[-1], np.memmap), "cached spins not memory-mapped"
+    for spins_ in spins[1:]:
+        np.testing.assert_array_equal(spins[0], spins_)
+
+
+def test_permutation_resampler_rotated_queries():
+    """test querying one tree of the sphere with inversely rotated coordinates assigns the same nearest neighbors as
+    querying a tree of the rotated sphere with the original coordinates"""
+    coords, hemiid = load_sphere("fsaverage", "3k", False)
+    seed = np.random.SeedSequence(0)
+    spins = np.empty((len(coords), 1), dtype=np.int32)
+    _spin_block(coords, hemiid, [seed], spins, 0)
+
+    reflect = np.diag([-1, 1, 1])
+    rot = _random_rotation(np.random.default_rng(seed))
+    for h, hemi_rot in enumerate([rot, reflect @ rot @ reflect]):
+        coor = coords[hemiid == h]
+        _, col = cKDTree(coor @ hemi_rot).query(coor, k=1)
+        np.testing.assert_array_equal(spins[hemiid == h, 0], np.flatnonzero(hemiid == h)[col])
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_subsample_resampler_patch_radius(atlas, density, n_vertices):
+    """test geodesic patches grow with their radius"""
+    rng = np.random.default_rng(seed=0)
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+
+    patch_sizes = []
+    for patch_radius in [15.0, 30.0, 60.0]:
+        resampler = SubsampleResampler(n_subsamples=100, patch_radius=patch_radius, seed=0).fit(X, Y)
+        assert np.all(np.isfinite(resampler.params_)), "patch correlations are not finite"
+        patch_sizes.append(resampler._patches.sum(axis=1))
+    assert np.all(np.diff(patch_sizes, axis=0) >= 0), "patches do not grow with radius"
+    assert np.all(patch_sizes[-1] > patch_sizes[0]), "patches do not grow with radius"
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", atlas_density_params)
+def test_bootstrap_resampler(atlas, density, n_vertices):
+    """test resampler on pair of uncorrelated maps"""
+    rng = np.random.default_rng(seed=0)
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+
+    resampler = BootstrapResampler(n_bootstraps=100, n_blocks=50, seed=0)
+    resampler.fit(X, Y)
+
+    np.testing.assert_allclose(resampler.param_, 0, atol=0.015)
+    np.testing.assert_allclose(np.mean(resampler.params_), 0, atol=0.005)
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_eigenstrap_resampler(atlas, density, n_vertices):
+    """test resampler on pair of uncorrelated maps, and chunked surrogates match a single chunk"""
+    rng = np.random.default_rng(seed=0)
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+
+    resampler = EigenstrapResampler(n_surrogates=100, n_modes=200, chunk_size=7, seed=0)
+    resampler.fit(X, Y)
+
+    np.testing.assert_allclose(resampler.param_, 0, atol=0.015)
+    np.testing.assert_allclose(np.mean(resampler.params_), 0, atol=0.005)
+
+    params_ = clone(resampler).set_params(chunk_size=None, max_memory=None).fit(X, Y).params_
+    np.testing.assert_allclose(resampler.params_, params_)
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=500, batch_size=50, seed=0),
+        SubsampleResampler(n_subsamples=500, batch_size=50, seed=0),
+    ],
+)
+def test_sequential_resampler(resampler):
+    """test sequential resampling stops early on correlated maps, with the first draws of a full fit"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {hemi: X_data[hemi] + rng.normal(size=n_vertices) for hemi in X_data}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    resampler.fit(X, Y)
+    assert resampler.n_draws_ < 500, "sequential resampling did not stop early"
+    assert resampler.params_.shape == (resampler.n_draws_,), "incorrect shape of params_"
+    assert not resampler.null_
+
+    resampler_full = clone(resampler).set_params(batch_size=None).fit(X, Y)
+    assert resampler_full.n_draws_ == 500
+    np.testing.assert_allclose(resampler.params_, resampler_full.params_[: resampler.n_draws_])
+
+
+def test_subsample_resampler_batches(monkeypatch):
+    """test sequential batches grow each patch and standardize the maps once within a fit, without storing patches
+    across fits"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    n_grown = []
+    subsample_vertices = SubsampleResampler._subsample_vertices
+
+    def count_patches(self, A, u, coords=None):
+        n_grown.append(len(u))
+        return subsample_vertices(self, A, u, coords)
+
+    n_standardized = []
+
+    def count_maps(X, Y):
+        n_standardized.append(1)
+        return _stat_maps(X, Y)
+
+    monkeypatch.setattr(SubsampleResampler, "_subsample_vertices", count_patches)
+    monkeypatch.setattr("compare_brain_maps.resampling.subsample._stat_maps", count_maps)
+    # a wide central interval is not settled by a few hundred draws, so every batch is scored
+    resampler = SubsampleResampler(n_subsamples=300, alpha=0.9, batch_size=50, reuse_patches=False, seed=0)
+    resampler.fit(X, Y)
+    assert resampler.n_draws_ == 300, "sequential resampling stopped early"
+    assert sum(n_grown) == 2 * 300, "patches regrown across batches"
+    assert len(n_standardized) == 1, "maps standardized per batch"
+    assert not hasattr(resampler, "_patches"), "patches stored across fits"
+
+
+@pytest.mark.parametrize(
+    "resampler, stages",
+    [
+        (PermutationResampler(n_permutations=20, chunk_size=5, seed=0), {"sphere", "spins", "correlation"}),
+        (SubsampleResampler(n_subsamples=20, seed=0), {"adjacency", "patches", "correlation"}),
+        (BootstrapResampler(n_bootstraps=20, n_blocks=20, seed=0), {"sphere", "blocks", "correlation"}),
+        (EigenstrapResampler(n_surrogates=20, n_modes=50, chunk_size=5, seed=0), {"eigenpairs", "correlation"}),
+    ],
+)
+def test_resampler_timings(resampler, stages):
+    """test per-stage timings are recorded and the callback reports progress"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    progress = []
+    resampler.set_params(callback=lambda n_done, n_total: progress.append((n_done, n_total)))
+    resampler.fit(X, Y)
+
+    assert stages <= set(resampler.timings_), "missing stages in timings_"
+    for timing in resampler.timings_.values():
+        assert timing["time"] >= 0 and timing["memory"] >= 0
+    assert progress[-1] == (20, 20), "callback did not report all draws"
+    assert [n_done for n_done, _ in progress] == sorted(n_done for n_done, _ in progress)
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=10, seed=0),
+        SubsampleResampler(n_subsamples=10, seed=0),
+        BootstrapResampler(n_bootstraps=10, n_blocks=20, seed=0),
+        EigenstrapResampler(n_surrogates=10, n_modes=50, seed=0),
+    ],
+)
+def test_resampler_mask_medial(resampler):
+    """test resamplers on maps with a masked medial wall use the cortical vertices only"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+
+    resampler.fit(X, Y)
+    assert np.isfinite(resampler.param_), "param_ is not finite"
+    assert np.all(np.isfinite(resampler.params_)), "params_ are not finite"
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=10, seed=0),
+        SubsampleResampler(n_subsamples=10, patch_size=2, seed=0),
+        BootstrapResampler(n_bootstraps=10, n_blocks=10, seed=0),
+        EigenstrapResampler(n_surrogates=10, n_modes=50, seed=0),
+    ],
+)
+def test_resampler_parcellation(resampler):
+    """test resamplers on parcellated maps work on the parcel means"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices, n_parcels = 2562, 50
+
+    # voronoi parcels of random vertices on the sphere, per hemisphere
+    mesh, _ = load_atlas("fsaverage", "3k", "sphere")
+    parcellation = {}
+    for hemi in ["left", "right"]:
+        sphere = mesh.parts[hemi].coordinates
+        seeds = sphere[rng.choice(n_vertices, size=n_parcels, replace=False)]
+        parcellation[hemi] = np.argmin(((sphere[:, None] - seeds[None]) ** 2).sum(axis=2), axis=1) + 1
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, surface="inflated", mask_medial=True, parcellation=parcellation)
+    Y = Surface(Y_data, surface="inflated", mask_medial=True, parcellation=parcellation)
+    X_parcels, Y_parcels = X.parcellate(), Y.parcellate()
+    X_n = np.concatenate([X_parcels["left"], X_parcels["right"]])
+    Y_n = np.concatenate([Y_parcels["left"], Y_parcels["right"]])
+
+    resampler.fit(X, Y)
+    np.testing.assert_allclose(resampler.param_, np.corrcoef(X_n, Y_n)[0, 1])
+    assert np.all(np.isfinite(resampler.params_)), "params_ are not finite"
+
+
+def test_subsample_resampler_volume():
+    """test subsample resampler on pair of uncorrelated volumes"""
+    rng = np.random.default_rng(seed=0)
+    mask = np.zeros((20, 20, 20), dtype=bool)
+    mask[2:-2, 2:-2, 2:-2] = True
+    X = Volume(rng.normal(size=mask.sum()), mask=mask)
+    Y = Volume(rng.normal(size=mask.sum()), mask=mask)
+
+    resampler = SubsampleResampler(n_subsamples=100, patch_size=3, seed=0)
+    resampler.fit(X, Y)
+
+    np.testing.assert_allclose(resampler.param_, np.corrcoef(X.data, Y.data)[0, 1])
+    np.testing.assert_allclose(np.mean(resampler.params_), 0, atol=0.05)
+    assert resampler._get_patches(X).shape == (100, mask.sum())
+
+
+@pytest.mark.parametrize("chunk_size, batch_size", [(7, None), (50, None), (7, 20)])
+def test_permutation_resampler_streaming(chunk_size, batch_size):
+    """test streamed spins are not stored, and match stored spins whatever the block size"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=(n_vertices, 2)), "right": rng.normal(size=(n_vertices, 2))}
+    Y_data = {"left": rng.normal(size=(n_vertices, 3)), "right": rng.normal(size=(n_vertices, 3))}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+
+    resampler = PermutationResampler(
+        n_permutations=60, reuse_spins=False, chunk_size=chunk_size, batch_size=batch_size, seed=0
+    )
+    resampler.fit_many(X, Y)
+    assert not hasattr(resampler, "_spins"), "streamed spins were stored"
+
+    resampler_stored = PermutationResampler(n_permutations=60, seed=0).fit_many(X, Y)
+    np.testing.assert_allclose(resampler.params_, resampler_stored.params_[..., : resampler.n_draws_])
+
+    # a random state seeds every block of a fit from the same sequence
+    params_ = [
+        PermutationResampler(n_permutations=60, reuse_spins=False, chunk_size=size, seed=np.random.RandomState(0))
+        .fit_many(X, Y)
+        .params_
+        for size in [chunk_size, 60]
+    ]
+    np.testing.assert_allclose(params_[0], params_[1])
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=10, seed=0),
+        SubsampleResampler(n_subsamples=10, seed=0),
+        BootstrapResampler(n_bootstraps=10, n_blocks=20, seed=0),
+    ],
+)
+def test_resampler_refit_rows(resampler):
+    """test reused spins, patches and blocks are regenerated when the rows of the maps change"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    for mask_medial in [False, True, False]:
+        X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=mask_medial)
+        Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=mask_medial)
+        resampler.fit(X, Y)
+        params_ = clone(resampler).fit(X, Y).params_
+        np.testing.assert_allclose(resampler.params_, params_)
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=100, max_memory=1, seed=0),
+        PermutationResampler(n_permutations=100, max_memory=1, reuse_spins=False, seed=0),
+        EigenstrapResampler(n_surrogates=100, n_modes=50, max_memory=1, seed=0),
+    ],
+)
+def test_resampler_max_memory(resampler):
+    """test the peak memory of scoring resampled maps stays within `max_memory`"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=(n_vertices, 2)), "right": rng.normal(size=(n_vertices, 2))}
+    Y_data = {"left": rng.normal(size=(n_vertices, 3)), "right": rng.normal(size=(n_vertices, 3))}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    resampler.fit_many(X, Y)
+    assert resampler.timings_["correlation"]["memory"] <= resampler.max_memory * 2**20
+    params_ = clone(resampler).set_params(max_memory=None).fit_many(X, Y).params_
+    np.testing.assert_allclose(resampler.params_, params_)
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        PermutationResampler(n_permutations=10, chunk_size=3, seed=0),
+        PermutationResampler(n_permutations=10, chunk_size=3, reuse_spins=False, seed=0),
+        SubsampleResampler(n_subsamples=10, seed=0),
+        BootstrapResampler(n_bootstraps=10, n_blocks=20, seed=0),
+        EigenstrapResampler(n_surrogates=10, n_modes=20, chunk_size=3, seed=0),
+    ],
+)
+def test_resampler_integer_maps(resampler):
+    """test integer maps (e.g. label or count maps) are resampled as their float values"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.integers(10, size=n_vertices), "right": rng.integers(10, size=n_vertices)}
+    Y_data = {"left": rng.integers(10, size=n_vertices), "right": rng.integers(10, size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    X_float = X.with_data({hemi: data.astype(float) for hemi, data in X_data.items()})
+    Y_float = Y.with_data({hemi: data.astype(float) for hemi, data in Y_data.items()})
+
+    resampler.fit(X, Y)
+    np.testing.assert_allclose(resampler.params_, clone(resampler).fit(X_float, Y_float).params_)
+
+
+def test_bootstrap_resampler_n_blocks():
+    """test more blocks than parcels of a hemisphere raise a clear error"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    parcellation = {hemi: rng.integers(1, 11, size=n_vertices) for hemi in ["left", "right"]}  # 10 parcels
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, surface="inflated", parcellation=parcellation)
+    Y = Surface(Y_data, surface="inflated", parcellation=parcellation)
+
+    with pytest.raises(ValueError, match="n_blocks must be at most"):
+        BootstrapResampler(n_bootstraps=10, seed=0).fit(X, Y)
+    resampler = BootstrapResampler(n_bootstraps=10, n_blocks=10, seed=0).fit(X, Y)
+    assert np.all(np.isfinite(resampler.params_)), "params_ are not finite"
+
+
+@pytest.mark.parametrize(
+    "resampler",
+    [
+        SubsampleResampler(n_subsamples=250, seed=0),
+        SubsampleResampler(n_subsamples=250, batch_size=150, seed=0),
+        BootstrapResampler(n_bootstraps=250, n_blocks=20, seed=0),
+    ],
+)
+def test_resampler_callback_chunks(resampler):
+    """test the callback is called after each chunk of draws, without changing the draws"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+
+    X_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    Y_data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(X_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+    Y = Surface(Y_data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    progress = []
+    resampler.set_params(callback=lambda n_done, n_total: progress.append(n_done))
+    resampler.fit(X, Y)
+    n_draws = resampler.params_.shape[-1]
+    assert len(progress) > 1 and progress[-1] == n_draws, "callback not called after each chunk"
+    assert max(np.diff(progress, prepend=0)) <= 100, "chunks of draws larger than between calls to the callback"
+
+    params_ = clone(resampler).set_params(callback=None).fit(X, Y).params_
+    np.testing.assert_allclose(resampler.params_, params_)
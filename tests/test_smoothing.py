@@ -1,8 +1,11 @@
 import numpy as np
 import pytest
+from lapy import Solver, TriaMesh
+from scipy import sparse
+from scipy.sparse.linalg import expm_multiply
 
-from compare_brain_maps.smoothing import HeatKernelSmoother, NearestNeighborSmoother
-from compare_brain_maps.utils import Surface
+from compare_brain_maps.smoothing import GaussianKernelSmoother, HeatKernelSmoother, NearestNeighborSmoother
+from compare_brain_maps.utils import Surface, Volume
 
 atlas_density_params = [
     ("fsaverage", "3k", 2562),
@@ -54,3 +57,181 @@ def test_heat_kernel_smoother(atlas, density, n_vertices):
         assert not np.array_equal(data, data_smoothed), f"{hemi} smoothing not applied"
         np.testing.assert_almost_equal(data.mean(), data_smoothed.mean(), decimal=2)
         assert data.std() > data_smoothed.std(), f"{hemi} smoothing does not reduce variability"
+
+
+def test_heat_kernel_smoother_cache(tmp_path):
+    """test eigenpairs persist on disk and fewer modes are sliced from the stored eigenpairs"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+    data = {"left": rng.standard_normal(n_vertices), "right": rng.standard_normal(n_vertices)}
+    X = Surface(data=data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    HeatKernelSmoother(n_modes=100, cache_dir=tmp_path, seed=0).transform(X)
+    n_files = len(list(tmp_path.glob("*.npy")))
+    assert n_files >= 2, "eigenpairs not cached"
+
+    smoother = HeatKernelSmoother(n_modes=50, cache_dir=tmp_path, seed=0)
+    X_smoothed = smoother.transform(X)
+    assert len(list(tmp_path.glob("*.npy"))) == n_files, "eigenpairs recomputed instead of sliced"
+    assert isinstance(smoother._eigenpairs["left"][1], np.memmap), "cached eigenmodes not memory-mapped"
+
+    X_expected = HeatKernelSmoother(n_modes=50, seed=0).transform(X)
+    for hemi in ["left", "right"]:
+        np.testing.assert_allclose(X_smoothed.data.parts[hemi], X_expected.data.parts[hemi], atol=1e-6)
+
+
+def test_heat_kernel_smoother_batched():
+    """test smoothing a stack of maps at several sigmas matches smoothing each map at each sigma"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices, n_maps, sigmas = 2562, 3, [0.5, 1.0, 2.0]
+    data = {"left": rng.standard_normal((n_vertices, n_maps)), "right": rng.standard_normal((n_vertices, n_maps))}
+    X = Surface(data=data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    smoother = HeatKernelSmoother(sigma=sigmas, n_modes=100, seed=0)
+    X_smoothed = smoother.transform(X)
+
+    for hemi in ["left", "right"]:
+        smoothed = X_smoothed.data.parts[hemi].reshape(n_vertices, len(sigmas), n_maps)
+        for i, sigma in enumerate(sigmas):
+            smoother.set_params(sigma=sigma)
+            for j in range(n_maps):
+                X_j = Surface({h: data[h][:, j] for h in data}, atlas="fsaverage", density="3k", surface="inflated")
+                np.testing.assert_allclose(smoothed[:, i, j], smoother.transform(X_j).data.parts[hemi])
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_heat_kernel_smoother_chebyshev(atlas, density, n_vertices):
+    """test the chebyshev expansion matches the matrix exponential of the lumped-mass operator, up to `tol`"""
+    rng = np.random.default_rng(seed=0)
+    sigmas = [0.5, 1.0, 2.0]
+    data = {"left": rng.standard_normal(n_vertices), "right": rng.standard_normal(n_vertices)}
+    data = {key: (values - np.mean(values)) / np.std(values) for key, values in data.items()}  # standardize
+
+    smoother = HeatKernelSmoother(sigma=sigmas, method="chebyshev")
+    X = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    X_smoothed = smoother.transform(X)
+
+    for hemi in ["left", "right"]:
+        mesh = X.mesh.parts[hemi]
+        fem = Solver(geometry=TriaMesh(v=mesh.coordinates, t=mesh.faces), lump=True)
+        mass = fem.mass.diagonal()
+        L = sparse.csr_array(sparse.diags_array(1 / mass) @ fem.stiffness)
+        x = data[hemi] - mass @ data[hemi] / mass.sum()  # without the constant mode
+        for i, sigma in enumerate(sigmas):
+            expected = expm_multiply(-sigma * L, x)
+            np.testing.assert_allclose(X_smoothed.data.parts[hemi][:, i], expected, rtol=0, atol=smoother.tol)
+
+
+def test_nearest_neighbor_smoother_batched():
+    """test smoothing a stack of maps matches smoothing each map"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices, n_maps = 2562, 3
+    data = {"left": rng.standard_normal((n_vertices, n_maps)), "right": rng.standard_normal((n_vertices, n_maps))}
+    X = Surface(data=data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    smoother = NearestNeighborSmoother(n_iterations=3).fit(X)
+    X_smoothed = smoother.transform(X)
+
+    for j in range(n_maps):
+        X_j = Surface({hemi: data[hemi][:, j] for hemi in data}, atlas="fsaverage", density="3k", surface="inflated")
+        X_j_smoothed = smoother.transform(X_j)
+        for hemi in ["left", "right"]:
+            np.testing.assert_allclose(X_smoothed.data.parts[hemi][:, j], X_j_smoothed.data.parts[hemi])
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_gaussian_kernel_smoother(atlas, density, n_vertices):
+    rng = np.random.default_rng(seed=0)
+    data = {"left": rng.standard_normal(n_vertices), "right": rng.standard_normal(n_vertices)}
+    data = {key: (values - np.mean(values)) / np.std(values) for key, values in data.items()}  # standardize
+
+    X = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+    X_smoothed = GaussianKernelSmoother(fwhm=10.0).transform(X)
+    X_smoothed_wide = GaussianKernelSmoother(fwhm=20.0).transform(X)
+
+    assert isinstance(X_smoothed, Surface), "Surface object not returned"
+
+    for hemi in ["left", "right"]:
+        data, data_smoothed = X.data.parts[hemi], X_smoothed.data.parts[hemi]
+        assert not np.array_equal(data, data_smoothed), f"{hemi} smoothing not applied"
+        np.testing.assert_almost_equal(data.mean(), data_smoothed.mean(), decimal=2)
+        assert data.std() > data_smoothed.std(), f"{hemi} smoothing does not reduce variability"
+        assert data_smoothed.std() > X_smoothed_wide.data.parts[hemi].std(), f"{hemi} smoothing does not grow with fwhm"
+
+
+def test_gaussian_kernel_smoother_reuse():
+    """test the kernel is held by the smoother, reused when only `n_jobs` changes and rebuilt with the FWHM"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+    data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    smoother = GaussianKernelSmoother(fwhm=6.0, n_jobs=1).fit(X)
+    kernel = smoother._kernel
+    assert smoother.set_params(n_jobs=2).fit(X)._kernel is kernel, "kernel rebuilt for another n_jobs"
+    assert smoother.set_params(fwhm=8.0).fit(X)._kernel is not kernel, "kernel of another fwhm reused"
+    assert GaussianKernelSmoother(fwhm=6.0, n_jobs=1).fit(X)._kernel is not kernel, "kernel shared across smoothers"
+
+
+@pytest.mark.parametrize(
+    "smoother, stages",
+    [
+        (HeatKernelSmoother(n_modes=50, seed=0), {"eigenpairs", "smoothing"}),
+        (HeatKernelSmoother(method="chebyshev"), {"operator", "smoothing"}),
+        (NearestNeighborSmoother(n_iterations=2), {"transition", "smoothing"}),
+        (GaussianKernelSmoother(fwhm=6.0), {"kernel", "smoothing"}),
+    ],
+)
+def test_smoother_timings(smoother, stages):
+    """test per-stage timings of transform are recorded"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+    data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=False)
+
+    smoother.fit(X).transform(X)
+    assert set(smoother.timings_) == stages, "incorrect stages in timings_"
+    for timing in smoother.timings_.values():
+        assert timing["time"] >= 0 and timing["memory"] >= 0
+
+
+@pytest.mark.parametrize(
+    "smoother",
+    [
+        HeatKernelSmoother(n_modes=50, seed=0),
+        HeatKernelSmoother(method="chebyshev"),
+        NearestNeighborSmoother(n_iterations=2),
+        GaussianKernelSmoother(fwhm=6.0),
+    ],
+)
+def test_smoother_mask_medial(smoother):
+    """test smoothers on maps with a masked medial wall smooth the cortex only"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices = 2562
+    data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+    vertices, _, _ = X.get_cortex()
+
+    X_smoothed = smoother.fit(X).transform(X)
+    for hemi in ["left", "right"]:
+        cortex = np.zeros(n_vertices, dtype=bool)
+        cortex[vertices[hemi]] = True
+        smoothed = X_smoothed.data.parts[hemi]
+        assert smoothed.shape == (n_vertices,), "incorrect shape of smoothed data"
+        assert np.all(np.isfinite(smoothed[cortex])), f"{hemi} cortex is not finite"
+        assert np.all(np.isnan(smoothed[~cortex])), f"{hemi} medial wall is not NaN"
+        assert smoothed[cortex].std() < X.data.parts[hemi][cortex].std(), f"{hemi} is not smoothed"
+
+
+def test_nearest_neighbor_smoother_volume():
+    """test nearest neighbor smoothing of the voxels of a volume"""
+    rng = np.random.default_rng(seed=0)
+    mask = np.ones((10, 10, 10), dtype=bool)
+    X = Volume(rng.normal(size=(mask.sum(), 2)), mask=mask, connectivity=26)
+
+    X_smooth = NearestNeighborSmoother(n_iterations=2).fit(X).transform(X)
+    assert X_smooth.shape == X.shape
+    assert np.all(X_smooth.data.std(axis=0) < X.data.std(axis=0)), "variance not reduced"
+
+    X_constant = NearestNeighborSmoother().fit_transform(X.with_data(np.ones(mask.sum())))
+    np.testing.assert_allclose(X_constant.data, 1)
@@ -1,7 +1,14 @@
+import tracemalloc
+
+import nibabel as nib
 import numpy as np
 import pytest
+from nilearn.surface import InMemoryMesh, PolyMesh
 
-from compare_brain_maps.utils import Surface
+from compare_brain_maps.utils import Surface, Volume
+from compare_brain_maps.utils._eigen import load_mesh_eigenpairs
+from compare_brain_maps.utils._profile import profile, stage
+from compare_brain_maps.utils.surface import load_atlas
 
 atlas_density_params = [
     ("fsaverage", "3k", 2562),
@@ -46,3 +53,211 @@ def test_adjacency(atlas, density, n_vertices):
         sparsity = A[hemi].nnz / (A[hemi].shape[0] ** 2)
         assert sparsity < 0.01, f"{hemi} is not sparse"
         assert A[hemi].nnz > A_masked[hemi].nnz, f"{hemi} medial wall not excluded"
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_surface_shares_atlas(atlas, density, n_vertices):
+    """test surfaces of the same atlas share one read-only mesh and medial wall mask"""
+    data = {"left": np.ones(n_vertices), "right": np.ones(n_vertices)}
+    X = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=True)
+    Y = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=False)
+
+    mesh, _ = load_atlas(atlas, density, "inflated")
+    assert X.medial is Y.medial, "medial wall mask not shared"
+    for hemi in ["left", "right"]:
+        assert X.mesh.parts[hemi].faces is Y.mesh.parts[hemi].faces, f"{hemi} faces not shared"
+        assert not mesh.parts[hemi].coordinates.flags.writeable, f"{hemi} atlas coordinates are writeable"
+        coordinates = X.mesh.parts[hemi].coordinates
+        assert not np.shares_memory(coordinates, mesh.parts[hemi].coordinates), f"{hemi} coordinates not copied"
+        assert X.mesh.parts[hemi].coordinates is coordinates, f"{hemi} coordinates copied on every access"
+        assert not X.medial.parts[hemi].flags.writeable, f"{hemi} medial wall mask is writeable"
+        assert not np.shares_memory(X.data.parts[hemi], Y.data.parts[hemi]), f"{hemi} data is shared"
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_graph_operators(atlas, density, n_vertices):
+    data = {"left": np.ones(n_vertices), "right": np.ones(n_vertices)}
+    X = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=True)
+    Y = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=True)
+    A, D, T, L = X.get_adjacency(), X.get_degree(), X.get_transition(), X.get_laplacian()
+
+    for hemi in ["left", "right"]:
+        assert A[hemi] is Y.get_adjacency()[hemi], f"{hemi} adjacency not cached"
+        np.testing.assert_array_equal(D[hemi], A[hemi].sum(axis=1))
+        np.testing.assert_allclose(T[hemi].sum(axis=1), D[hemi] > 0)
+        np.testing.assert_allclose(L[hemi].sum(axis=1), 0)
+        assert (L[hemi] != L[hemi].T).nnz == 0, f"{hemi} laplacian is asymmetric"
+
+
+def test_surface_plot():
+    """test surfaces can be plotted by nilearn, which centers the mesh coordinates in place"""
+    plt = pytest.importorskip("matplotlib.pyplot")
+    from nilearn.plotting import plot_surf
+
+    n_vertices = 2562
+    data = {"left": np.arange(n_vertices, dtype=float), "right": np.arange(n_vertices, dtype=float)}
+    X = Surface(data=data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+    mesh, _ = load_atlas("fsaverage", "3k", "inflated")
+    coordinates = mesh.parts["left"].coordinates.copy()
+
+    for hemi in ["left", "both"]:
+        plot_surf(surf_map=X, hemi=hemi)
+        plt.close("all")
+    np.testing.assert_array_equal(mesh.parts["left"].coordinates, coordinates)
+
+
+def test_surface_with_data():
+    """test surfaces with new data share everything but the data"""
+    n_vertices = 2562
+    data = {"left": np.ones(n_vertices), "right": np.ones(n_vertices)}
+    X = Surface(data=data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=True)
+    new_data = {"left": np.zeros(n_vertices), "right": np.zeros(n_vertices)}
+    X_new = X.with_data(new_data)
+
+    assert isinstance(X_new, Surface), "Surface object not returned"
+    assert X_new.mesh is X.mesh and X_new.medial is X.medial, "mesh not shared"
+    assert X_new.get_adjacency()["left"] is X.get_adjacency()["left"], "adjacency not shared"
+    for hemi in ["left", "right"]:
+        assert X_new.data.parts[hemi] is new_data[hemi], f"{hemi} data copied"
+        assert np.isnan(X.data.parts[hemi]).sum() > 0, f"{hemi} data of the original surface modified"
+
+
+@pytest.mark.parametrize("atlas, density, n_vertices", [("fsaverage", "3k", 2562), ("fsLR", "4k", 4002)])
+def test_surface_cortex(atlas, density, n_vertices):
+    """test the compact index space of the cortex maps between full and compact vertices"""
+    rng = np.random.default_rng(seed=0)
+    data = {"left": rng.normal(size=n_vertices), "right": rng.normal(size=n_vertices)}
+    X = Surface(data=data, atlas=atlas, density=density, surface="inflated", mask_medial=True)
+    vertices, index, mesh = X.get_cortex()
+    X_data = X.compress()
+    A, A_compact = X.get_adjacency(), X.get_adjacency(compact=True)
+
+    for hemi in ["left", "right"]:
+        n_cortex = len(vertices[hemi])
+        assert n_cortex < n_vertices, f"{hemi} medial wall not excluded"
+        assert np.all(X.medial.parts[hemi][vertices[hemi]]), f"{hemi} medial wall vertex in the cortex"
+        np.testing.assert_array_equal(index[hemi][vertices[hemi]], np.arange(n_cortex))
+        assert mesh.parts[hemi].n_vertices == n_cortex and mesh.parts[hemi].faces.max() == n_cortex - 1
+        assert X_data[hemi].shape == (n_cortex,) and not np.any(np.isnan(X_data[hemi])), f"{hemi} contains nans"
+        assert A_compact[hemi].shape == (n_cortex, n_cortex)
+        assert (A[hemi][vertices[hemi]][:, vertices[hemi]] != A_compact[hemi]).nnz == 0, f"{hemi} edges differ"
+
+    X_expanded = X.expand(X_data)
+    for hemi in ["left", "right"]:
+        np.testing.assert_array_equal(X_expanded.data.parts[hemi], X.data.parts[hemi])
+
+
+def _voronoi_parcellation(atlas, density, n_parcels, seed=0):
+    """labels 1, ..., n_parcels of voronoi cells of random vertices on the sphere, per hemisphere"""
+    rng = np.random.default_rng(seed)
+    mesh, _ = load_atlas(atlas, density, "sphere")
+    parcellation = {}
+    for hemi in ["left", "right"]:
+        coords = mesh.parts[hemi].coordinates
+        seeds = coords[rng.choice(len(coords), size=n_parcels, replace=False)]
+        parcellation[hemi] = np.argmin(((coords[:, None] - seeds[None]) ** 2).sum(axis=2), axis=1) + 1
+    return parcellation
+
+
+@pytest.mark.parametrize("mask_medial", [False, True])
+def test_surface_parcellation(mask_medial):
+    """test parcel means, centroids and adjacency of a parcellated surface"""
+    rng = np.random.default_rng(seed=0)
+    n_vertices, n_parcels = 2562, 40
+    parcellation = _voronoi_parcellation("fsaverage", "3k", n_parcels)
+    parcellation["left"][:10] = 0  # unassigned vertices
+    data = {"left": rng.normal(size=(n_vertices, 3)), "right": rng.normal(size=(n_vertices, 3))}
+    X = Surface(
+        data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=mask_medial, parcellation=parcellation
+    )
+
+    labels, _ = X.get_parcels()
+    X_parcels = X.parcellate()
+    centroids = X.get_parcel_centroids("sphere")
+    A = X.get_parcel_adjacency()
+    vertices, _, _ = X.get_cortex()
+    radius = np.linalg.norm(load_atlas("fsaverage", "3k", "sphere")[0].parts["left"].coordinates, axis=1).mean()
+
+    for hemi in ["left", "right"]:
+        in_cortex = np.isin(np.arange(n_vertices), vertices[hemi])
+        expected = [data[hemi][(parcellation[hemi] == label) & in_cortex].mean(axis=0) for label in labels[hemi]]
+        assert 0 not in labels[hemi], f"{hemi} unassigned vertices form a parcel"
+        np.testing.assert_allclose(X_parcels[hemi], expected)
+        np.testing.assert_allclose(np.linalg.norm(centroids[hemi], axis=1), radius)
+        assert (A[hemi] != A[hemi].T).nnz == 0 and not np.any(A[hemi].diagonal()), f"{hemi} adjacency not simple"
+        assert np.all(A[hemi].sum(axis=1) > 0), f"{hemi} isolated parcel"
+
+    assert X.with_data(data).get_parcels() is X.get_parcels(), "operators are not shared by with_data"
+    Y = Surface(
+        data, atlas="fsaverage", density="3k", surface="inflated", mask_medial=mask_medial, parcellation=parcellation
+    )
+    assert Y.get_parcels() is X.get_parcels(), "operators are not shared between surfaces"
+
+
+@pytest.mark.parametrize("connectivity", [6, 18, 26])
+def test_volume(tmp_path, connectivity):
+    """test a memory-mapped volume stores the voxels of the mask and their neighborhood graph"""
+    rng = np.random.default_rng(seed=0)
+    data = rng.normal(size=(7, 8, 9, 3))
+    mask = np.zeros((7, 8, 9), dtype=bool)
+    mask[1:-1, 1:-1, 1:-1] = True
+    mask[3, 3, 3] = False
+    nib.save(nib.Nifti1Image(data, affine=np.diag([2.0, 2.0, 2.0, 1.0])), tmp_path / "maps.nii")
+    nib.save(nib.Nifti1Image(mask.astype(np.int8), affine=np.diag([2.0, 2.0, 2.0, 1.0])), tmp_path / "mask.nii")
+
+    X = Volume(tmp_path / "maps.nii", mask=tmp_path / "mask.nii", connectivity=connectivity)
+    assert X.shape == (mask.sum(), 3)
+    np.testing.assert_array_equal(X.data, data[mask])
+    np.testing.assert_array_equal(X.to_img().get_fdata()[mask], data[mask])
+    np.testing.assert_allclose(X.get_coordinates()["volume"], 2 * np.argwhere(mask))
+
+    A = X.get_adjacency()["volume"]
+    degree = X.get_degree()["volume"]
+    assert (A != A.T).nnz == 0 and not np.any(A.diagonal()), "adjacency not simple"
+    ijk = np.argwhere(mask)
+    interior = np.all((ijk >= 2) & (ijk <= np.array(mask.shape) - 3), axis=1) & np.any(np.abs(ijk - 3) > 1, axis=1)
+    assert np.all(degree[interior] == connectivity), "interior voxels miss neighbors"
+    assert np.all(degree <= connectivity)
+    np.testing.assert_allclose(X.get_transition()["volume"].sum(axis=1), 1)
+    assert X.with_data(X.data).get_adjacency()["volume"] is A, "operators are not shared by with_data"
+
+
+def test_load_mesh_eigenpairs():
+    """test stored eigenpairs are reused only with enough modes on the same meshes"""
+    X = Surface({"left": np.zeros(2562), "right": np.zeros(2562)}, surface="inflated", mask_medial=True)
+    _, _, mesh = X.get_cortex()
+    full_mesh = X.mesh
+
+    stored = load_mesh_eigenpairs(mesh, 20, seed=0)
+    assert load_mesh_eigenpairs(mesh, 10, stored=stored) is stored, "stored eigenpairs not reused"
+    _, more = load_mesh_eigenpairs(mesh, 30, stored=stored, seed=0)
+    assert more["left"][0].size == 30 and more["right"][1].shape == (mesh.parts["right"].n_vertices, 30)
+    _, other = load_mesh_eigenpairs(full_mesh, 10, stored=stored, seed=0)
+    assert other["left"][1].shape[0] == 2562, "eigenpairs of another mesh reused"
+
+    # a mesh with as many vertices and the same faces, as of another surface (e.g. pial and inflated) or atlas
+    stretched = PolyMesh(
+        **{
+            hemi: InMemoryMesh(coordinates=part.coordinates * [1.0, 2.0, 0.5], faces=part.faces)
+            for hemi, part in full_mesh.parts.items()
+        }
+    )
+    stored = load_mesh_eigenpairs(full_mesh, 10, seed=0)
+    _, other = load_mesh_eigenpairs(stretched, 10, stored=stored, seed=0)
+    assert not np.allclose(other["left"][0], stored[1]["left"][0]), "eigenpairs of a mesh of the same size reused"
+
+
+def test_profile_caller_peak():
+    """test profiled stages leave the peak memory traced by the caller untouched"""
+    tracemalloc.start()
+    try:
+        data = np.ones(2**20)
+        del data
+        _, peak = tracemalloc.get_traced_memory()
+        with profile() as timings:
+            with stage("sum"):
+                np.ones(2**10).sum()
+        assert "sum" in timings, "stage not recorded"
+        assert tracemalloc.get_traced_memory()[1] >= peak, "peak memory of the caller reset"
+    finally:
+        tracemalloc.stop()